@@ -0,0 +1,122 @@
+from itertools import combinations
+
+import numpy as np
+
+# -----------------------------
+# Приближённый поиск соседей (LSH)
+# -----------------------------
+# Random-hyperplane LSH для косинусного сходства, только NumPy.
+# Каждая таблица хэширует вектор в n_bits знаков проекций на случайные
+# гиперплоскости; похожие векторы с высокой вероятностью попадают
+# в одну корзину хотя бы в одной таблице.
+#
+# Компромисс полнота / скорость:
+#   n_tables ↑  — выше полнота, больше кандидатов и памяти
+#   n_bits ↑    — корзины мельче, меньше кандидатов, ниже полнота
+#   probes      — радиус multi-probe по Хэммингу: 0 — только своя
+#                 корзина, 1 — ещё n_bits соседних, 2 — ещё C(n_bits, 2)
+#
+# Запрос стоит O(кандидатов), а не O(размера индекса): строки корзин
+# собираются срезами отсортированных массивов, склеиваются и очищаются
+# от повторов сортировкой. Булева маска на весь индекс — только когда
+# кандидатов больше 1 / DENSE_FRACTION его размера.
+
+DENSE_FRACTION = 8
+
+
+class LSHIndex:
+    def __init__(self, n_tables: int = 16, n_bits: int = 12, probes: int = 1, seed: int = 42):
+        if not 0 <= probes <= n_bits:
+            raise ValueError(f"probes должно быть от 0 до n_bits ({n_bits}), получено {probes}")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probes = probes
+        self.seed = seed
+
+        # маски XOR для всех корзин на расстоянии Хэмминга <= probes
+        self._flips = np.array([
+            sum(1 << b for b in bits) for r in range(probes + 1) for bits in combinations(range(n_bits), r)
+        ], dtype=np.int64)
+        self.planes = None
+        self._sorted_codes = []   # по таблице: отсортированные коды
+        self._sorted_rows = []    # по таблице: строки матрицы в том же порядке
+        # несортированный хвост (строки, коды) — одним кортежем: add()
+        # подменяет его целиком, и candidates() без блокировки не увидит
+        # массивы разной длины
+        self._extra = (np.empty(0, dtype=np.int64), np.empty((0, n_tables), dtype=np.int64))
+
+    def __len__(self):
+        size = len(self._sorted_rows[0]) if self._sorted_rows else 0
+        return size + len(self._extra[0])
+
+    def _codes(self, vectors):
+        # vectors: CSR или dense (n × d) -> коды (n × n_tables)
+        projected = np.asarray(vectors @ self.planes)
+        bits = (projected > 0).reshape(-1, self.n_tables, self.n_bits)
+        return bits.astype(np.int64) @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+    def build(self, matrix):
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((matrix.shape[1], self.n_tables * self.n_bits))
+
+        codes = self._codes(matrix)
+        self._sorted_codes, self._sorted_rows = [], []
+        for t in range(self.n_tables):
+            order = np.argsort(codes[:, t], kind='stable')
+            self._sorted_codes.append(codes[order, t])
+            self._sorted_rows.append(order.astype(np.int64))
+        self._extra = (np.empty(0, dtype=np.int64), np.empty((0, self.n_tables), dtype=np.int64))
+        return self
+
+    def add(self, first_row: int, vectors):
+        # Новые строки не пересортировываем: хранятся отдельно
+        # и проверяются линейно до следующей перестройки индекса
+        codes = self._codes(vectors)
+        rows = np.arange(first_row, first_row + codes.shape[0], dtype=np.int64)
+        extra_rows, extra_codes = self._extra
+        self._extra = (np.concatenate([extra_rows, rows]), np.vstack([extra_codes, codes]))
+
+    def candidates(self, vector) -> np.ndarray:
+        query = self._codes(np.asarray(vector).reshape(1, -1))[0]
+        extra_rows, extra_codes = self._extra
+        found = []
+        for t in range(self.n_tables):
+            probe = query[t] ^ self._flips
+            codes = self._sorted_codes[t]
+            starts = np.searchsorted(codes, probe, side='left')
+            lengths = np.searchsorted(codes, probe, side='right') - starts
+            total = int(lengths.sum())
+            if total:
+                # позиции всех срезов [start, end) одним массивом
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                found.append(self._sorted_rows[t][offsets + np.arange(total)])
+            if len(extra_rows):
+                found.append(extra_rows[np.isin(extra_codes[:, t], probe)])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(found)
+        if len(rows) * DENSE_FRACTION > len(self):
+            # кандидатов и так порядка размера индекса: маска дешевле сортировки
+            mask = np.zeros(len(self), dtype=bool)
+            mask[rows] = True
+            return np.flatnonzero(mask)
+        # np.unique в NumPy 2.x идёт через хэш-таблицу и на сотнях тысяч
+        # строк в разы медленнее сортировки с отбором соседей
+        rows = np.sort(rows)
+        return rows[np.concatenate(([True], rows[1:] != rows[:-1]))]
+
+    def stats(self) -> dict:
+        return {
+            "n_tables": self.n_tables,
+            "n_bits": self.n_bits,
+            "probes": self.probes,
+            "size": len(self),
+            "unsorted": len(self._extra[0]),
+        }
+
+
+def recall_at_k(exact_ids, approx_ids) -> float:
+    exact = set(int(i) for i in exact_ids)
+    if not exact:
+        return 1.0
+    return len(exact & set(int(i) for i in approx_ids)) / len(exact)
@@ -1,3 +1,7 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
@@ -39,14 +43,125 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str, db: Session) -> Optional[User]:
+def decode_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        login: str = payload.get("sub")
-        if login is None:
-            return None
     except JWTError:
         return None
-    
-    user = get_user_by_login(db, login)
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+def get_current_user(token: str, db: Session) -> Optional[User]:
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    return get_user_by_login(db, payload["sub"])
+
+# -----------------------------
+# Кэш токен -> пользователь
+# -----------------------------
+# Каждый авторизованный запрос раньше делал jwt.decode и SELECT по
+# users.login. Теперь проверенный токен на AUTH_CACHE_TTL секунд (но не
+# дольше срока жизни токена) отображается в лёгкий снимок пользователя.
+# Сбрасывается явно: update_profile и смена аватара — по user_id,
+# logout — по токену. Нужен ORM-объект для записи — session.get по
+# user_id из снимка.
+
+UserSnapshot = namedtuple("UserSnapshot", "user_id login first_name last_name phone avatar_url")
+
+def user_snapshot(user: User) -> UserSnapshot:
+    return UserSnapshot(user.user_id, user.login, user.first_name, user.last_name, user.phone, user.avatar_url)
+
+class UserCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()     # token -> (снимок, истекает)
+        self._tokens = {}                 # user_id -> {token}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] <= time.time():
+                self._drop(token)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, user: UserSnapshot, token_expires: float = None):
+        expires = time.time() + self.ttl
+        if token_expires is not None:
+            expires = min(expires, token_expires)
+        with self._lock:
+            self._drop(token, count=False)
+            self._entries[token] = (user, expires)
+            self._tokens.setdefault(user.user_id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)), count=False)
+
+    def invalidate_user(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                for token in list(self._tokens.get(user_id, ())):
+                    self._drop(token)
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._drop(token)
+
+    def _drop(self, token, count: bool = True):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens.get(entry[0].user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[entry[0].user_id]
+        if count:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+            }
+
+user_cache = UserCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "60"))
+)
+
+def resolve_user(token: str, db: Session) -> Optional[UserSnapshot]:
+    # Снимок пользователя по токену: из кэша или decode + SELECT
+    if not token:
+        return None
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    db_user = get_user_by_login(db, payload["sub"])
+    if db_user is None:
+        return None
+    user = user_snapshot(db_user)
+    user_cache.put(token, user, payload.get("exp"))
     return user
\ No newline at end of file
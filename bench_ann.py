@@ -0,0 +1,76 @@
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from ann_index import recall_at_k
+from car_recommendation import InventoryIndex, rank_rows
+from synthetic_data import synthetic_frame
+
+# -----------------------------
+# Бенчмарк recall@k: LSH против точного поиска
+# -----------------------------
+# Запуск:
+#   python bench_ann.py --cars 200000 --tables 8 --bits 12 --probes 1
+#
+# Инвентарь синтетический, без БД: сравнивается только этап сходства.
+
+
+def sample_profiles(matrix, users: int, likes: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    profiles = []
+    for _ in range(users):
+        rows = rng.choice(matrix.shape[0], size=likes, replace=False)
+        profiles.append(np.asarray(sparse.csr_matrix(matrix[rows]).mean(axis=0)).ravel())
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cars', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--likes', type=int, default=5)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--tables', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--bits', type=int, nargs='+', default=[10, 12, 14])
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 1])
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.cars)
+    exact_index = InventoryIndex()
+    exact_index.build_from_frame(df)
+    snap = exact_index.snapshot()
+    profiles = sample_profiles(snap.matrix, args.users, args.likes)
+
+    started = time.perf_counter()
+    exact = [rank_rows(snap, p, args.k, exact=True) for p in profiles]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(profiles)
+    print(f"cars={args.cars} k={args.k} exact: {exact_ms:.2f} ms/query")
+
+    for tables in args.tables:
+        for bits in args.bits:
+            for probes in args.probes:
+                index = InventoryIndex(
+                    ann_mode='lsh', ann_min_size=0,
+                    ann_params={'n_tables': tables, 'n_bits': bits, 'probes': probes}
+                )
+                build_started = time.perf_counter()
+                index.build_from_frame(df)
+                build_s = time.perf_counter() - build_started
+                ann_snap = index.snapshot()
+
+                started = time.perf_counter()
+                approx = [rank_rows(ann_snap, p, args.k) for p in profiles]
+                ann_ms = (time.perf_counter() - started) * 1000 / len(profiles)
+
+                recall = np.mean([recall_at_k(e, a) for e, a in zip(exact, approx)])
+                print(
+                    f"tables={tables:<3} bits={bits:<3} probes={probes} "
+                    f"recall@{args.k}={recall:.3f} {ann_ms:.2f} ms/query "
+                    f"(x{exact_ms / ann_ms:.1f}) build={build_s:.1f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
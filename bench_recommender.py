@@ -0,0 +1,121 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+from synthetic_data import generate, generate_favorites
+
+# -----------------------------
+# Бенчмарк рекомендаций на синтетическом инвентаре
+# -----------------------------
+# Запуск:
+#   python bench_recommender.py --sizes 1000 10000 100000 1000000 --likes 1 10 100
+#
+# Для каждого размера инвентаря создаётся (или переиспользуется)
+# scratch-база bench_data/cars_<N>.db. Каждый прогон идёт в отдельном
+# процессе, чтобы пиковая память (ru_maxrss) относилась только к нему.
+#
+# Замеры:
+#   load / encode  — построение InventoryIndex: чтение cars и кодирование
+#   profile        — загрузка лайков/продаж пользователя и его профиль
+#   similarity     — сходство и top-k по всему инвентарю
+#   miss / hit     — get_car_recommendations целиком без кэша профиля и с ним
+
+
+def percentiles(samples):
+    values = np.array(samples) * 1000
+    return f"p50={np.percentile(values, 50):7.2f} p99={np.percentile(values, 99):7.2f}"
+
+
+def run_case(db_path: str, users: int, requests: int, top_n: int, result_queue):
+    import models
+
+    models.Session.configure(bind=models.make_engine(f'sqlite:///{db_path}'))
+    import car_recommendation as cr
+
+    db = models.Session()
+    cr.inventory_index.build(db)
+    index_stats = cr.inventory_index.stats()
+
+    rng = np.random.default_rng(7)
+    user_ids = rng.integers(1, users + 1, size=requests)
+    profile_t, similarity_t, miss_t, hit_t = [], [], [], []
+
+    for user_id in user_ids:
+        user_id = int(user_id)
+
+        started = time.perf_counter()
+        entry = cr.profile_cache.load(db, user_id)
+        profile_t.append(time.perf_counter() - started)
+
+        profile = entry.profile()
+        if profile is not None:
+            started = time.perf_counter()
+            snap = cr.inventory_index.snapshot(exclude_ids=entry.exclude_ids)
+            cr.rank_rows(snap, profile, top_n)
+            similarity_t.append(time.perf_counter() - started)
+
+        cr.profile_cache.invalidate(user_id)
+        started = time.perf_counter()
+        cr.get_car_recommendations(user_id, top_n)
+        miss_t.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        cr.get_car_recommendations(user_id, top_n)
+        hit_t.append(time.perf_counter() - started)
+
+    db.close()
+    result_queue.put({
+        "load": index_stats["load_seconds"],
+        "encode": index_stats["build_seconds"] - index_stats["load_seconds"],
+        "profile": profile_t,
+        "similarity": similarity_t or [0.0],
+        "miss": miss_t,
+        "hit": hit_t,
+        # ru_maxrss в Linux — килобайты
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10_000, 100_000])
+    parser.add_argument('--likes', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--top-n', type=int, default=100)
+    parser.add_argument('--data-dir', default='bench_data')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    ctx = multiprocessing.get_context("spawn")
+
+    for size in args.sizes:
+        db_path = os.path.join(args.data_dir, f'cars_{size}.db')
+        if not os.path.exists(db_path):
+            started = time.perf_counter()
+            generate(db_path, size, args.users)
+            print(f"-- сгенерировано {size} машин за {time.perf_counter() - started:.1f} с")
+
+        for likes in args.likes:
+            generate_favorites(db_path, size, args.users, likes)
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(db_path, args.users, args.requests, args.top_n, queue))
+            proc.start()
+            r = queue.get()
+            proc.join()
+
+            print(
+                f"cars={size:<8} likes={likes:<4} "
+                f"load={r['load'] * 1000:8.1f}ms encode={r['encode'] * 1000:8.1f}ms "
+                f"peak={r['peak_mb']:7.1f}MB"
+            )
+            for phase in ("profile", "similarity", "miss", "hit"):
+                print(f"    {phase:<10} {percentiles(r[phase])} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import os
+import time
+
+from sqlalchemy import func, select
+
+import models
+from car_search import apply_filters, search_cars, sort_columns, SORTS
+from models import Car, ensure_schema, make_engine
+from synthetic_data import generate
+
+# -----------------------------
+# Бенчмарк поиска: keyset против OFFSET по глубине страниц
+# -----------------------------
+# Запуск:
+#   python bench_search.py --cars 1000000 --pages 1000
+#
+# Для каждого сценария (фильтры + сортировка) проходятся страницы 1..N
+# по курсору; печатается задержка страниц 1, 10, 100, N и для сравнения
+# та же страница N через OFFSET. Цель — страница 1000 на 1M строк не
+# медленнее первой.
+
+SCENARIOS = [
+    ("без фильтров, новые", {}, "newest"),
+    ("марка, по цене", {"brand": "brand0"}, "price_asc"),
+    ("марка+модель, по цене", {"brand": "brand1", "model": "brand1_model3"}, "price_desc"),
+    ("кузов, по цене", {"bodytype": "bodyType2"}, "price_asc"),
+    ("цена 1-3 млн, по цене", {"price_min": 1_000_000, "price_max": 3_000_000}, "price_asc"),
+    ("год от 2015, по году", {"year_min": 2015}, "year_desc"),
+    ("пробег до 50 тыс., топливо", {"mileage_max": 50_000, "fuel_type": "fuelType0"}, "mileage_asc"),
+    # фильтр + сортировка не по цене: без своих индексов — сортировка
+    # всех совпадений на каждой странице
+    ("марка, новые", {"brand": "brand0"}, "newest"),
+    ("марка+модель, новые", {"brand": "brand1", "model": "brand1_model3"}, "newest"),
+    ("кузов, новые", {"bodytype": "bodyType2"}, "newest"),
+    ("марка, по году", {"brand": "brand0"}, "year_desc"),
+    ("марка, по пробегу", {"brand": "brand0"}, "mileage_asc"),
+    ("кузов, по году", {"bodytype": "bodyType2"}, "year_desc"),
+    ("кузов, по пробегу", {"bodytype": "bodyType2"}, "mileage_asc"),
+]
+
+
+def offset_page(db, filters: dict, sort: str, page: int, limit: int):
+    column, descending = SORTS[sort]
+    query = apply_filters(select(Car), filters)
+    if column is not None:
+        query = query.where(column.isnot(None))
+    order = [c.desc() if descending else c.asc() for c in sort_columns(sort)]
+    return db.execute(query.order_by(*order).offset((page - 1) * limit).limit(limit)).scalars().all()
+
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_scenario(db, filters: dict, sort: str, pages: int, limit: int):
+    marks = sorted({1, 10, 100, pages})
+    latencies = {}
+    cursor = None
+    reached = 0
+    for page in range(1, pages + 1):
+        result, ms = timed(lambda: search_cars(db, filters, sort, limit, cursor))
+        reached = page
+        if page in marks:
+            latencies[page] = ms
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    _, offset_ms = timed(lambda: offset_page(db, filters, sort, reached, limit))
+    return reached, latencies, offset_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cars', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--data-dir', default='bench_data')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    db_path = os.path.join(args.data_dir, f'cars_{args.cars}.db')
+    if not os.path.exists(db_path):
+        started = time.perf_counter()
+        generate(db_path, args.cars, args.users)
+        print(f"-- сгенерировано {args.cars} машин за {time.perf_counter() - started:.1f} с")
+
+    engine = make_engine(f'sqlite:///{db_path}')
+    # база могла быть сгенерирована до появления индексов поиска
+    ensure_schema(engine)
+    models.Session.configure(bind=engine)
+    db = models.Session()
+    total = db.execute(select(func.count(Car.car_id))).scalar()
+    print(f"cars={total} limit={args.limit}")
+
+    for label, filters, sort in SCENARIOS:
+        reached, latencies, offset_ms = run_scenario(db, filters, sort, args.pages, args.limit)
+        marks = " ".join(f"p{page}={ms:6.2f}" for page, ms in latencies.items())
+        print(f"  {label:<28} {marks} ms | OFFSET p{reached}={offset_ms:7.2f} ms")
+        if reached < args.pages:
+            print(f"    (результатов только на {reached} страниц)")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import re
+import time
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, literal_column, select, text, tuple_
+from sqlalchemy.orm import Session
+
+from car_search import MAX_LIMIT, apply_filters, decode_cursor, encode_cursor, photos_for
+from models import Car, engine as default_engine
+from serializers import format_car_dict
+
+# -----------------------------
+# Полнотекстовый поиск объявлений
+# -----------------------------
+# SQLite: внешняя FTS5-таблица cars_fts (content='cars'), текст хранится
+# только в cars. Триггеры на insert / delete / update текстовых колонок
+# держат индекс в синхроне — в том числе для bulk-вставок через Core.
+# MariaDB: FULLTEXT-индекс ft_cars_text на тех же колонках, InnoDB
+# обновляет его сам (слова короче innodb_ft_min_token_size не ищутся).
+#
+# Запрос "toyota camry automatic" превращается в префиксный AND всех
+# слов; ранжирование — bm25 с весами колонок (марка и модель важнее
+# описания), структурные фильтры — те же, что в car_search.
+#
+# Заполнение индекса для уже существующих строк:
+#   python car_fts.py --rebuild
+
+FTS_COLUMNS = ["brand", "model", "bodytype", "color", "fuel_type", "vehicle_transmission", "description"]
+FTS_WEIGHTS = [10.0, 10.0, 4.0, 2.0, 2.0, 2.0, 1.0]
+MYSQL_INDEX = "ft_cars_text"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Таблица cars_fts вне Base.metadata: create_all её не создаёт
+fts_metadata = MetaData()
+cars_fts = Table("cars_fts", fts_metadata, Column("rowid", Integer), *[Column(c) for c in FTS_COLUMNS])
+
+
+def _columns(prefix: str = "") -> str:
+    return ", ".join(prefix + c for c in FTS_COLUMNS)
+
+
+def sqlite_ddl() -> list:
+    cols, new, old = _columns(), _columns("new."), _columns("old.")
+    insert_new = f"INSERT INTO cars_fts(rowid, {cols}) VALUES (new.car_id, {new});"
+    delete_old = f"INSERT INTO cars_fts(cars_fts, rowid, {cols}) VALUES ('delete', old.car_id, {old});"
+    return [
+        f"CREATE VIRTUAL TABLE cars_fts USING fts5({cols}, content='cars', content_rowid='car_id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS cars_fts_ai AFTER INSERT ON cars BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS cars_fts_ad AFTER DELETE ON cars BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS cars_fts_au AFTER UPDATE OF {cols} ON cars "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def fts_exists(conn) -> bool:
+    if conn.dialect.name == "sqlite":
+        return conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cars_fts'"
+        )).first() is not None
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+        "AND table_name = 'cars' AND index_name = :name"
+    ), {"name": MYSQL_INDEX}).first() is not None
+
+
+def ensure_fts(bind=default_engine) -> bool:
+    # Создаёт индекс, если его нет, и заполняет его по существующим строкам.
+    # Возвращает True, если индекс создан сейчас
+    with bind.begin() as conn:
+        if fts_exists(conn):
+            return False
+        if conn.dialect.name == "sqlite":
+            for statement in sqlite_ddl():
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO cars_fts(cars_fts) VALUES ('rebuild')")
+        else:
+            # FULLTEXT по существующим строкам строится сразу
+            conn.exec_driver_sql(f"ALTER TABLE cars ADD FULLTEXT INDEX {MYSQL_INDEX} ({_columns()})")
+    print("Создан полнотекстовый индекс объявлений")
+    return True
+
+
+def rebuild(bind=default_engine):
+    # Полная перестройка из cars: после сбоя синхронизации или импорта
+    # в обход триггеров
+    if not ensure_fts(bind):
+        with bind.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                conn.exec_driver_sql("INSERT INTO cars_fts(cars_fts) VALUES ('rebuild')")
+                conn.exec_driver_sql("INSERT INTO cars_fts(cars_fts) VALUES ('optimize')")
+            else:
+                conn.exec_driver_sql("OPTIMIZE TABLE cars")
+
+
+def query_terms(q: str) -> list:
+    return [t.lower() for t in TOKEN_RE.findall(q or "")]
+
+
+def match_expression(terms: list, dialect: str) -> str:
+    # Слова берутся только из \w+, так что кавычки и операторы
+    # пользователя в синтаксис запроса не попадают
+    if dialect == "sqlite":
+        return " AND ".join(f'"{t}"*' for t in terms)
+    return " ".join(f"+{t}*" for t in terms)
+
+
+def scored_matches(q: str, dialect: str):
+    # Подзапрос (car_id, score): чем больше score, тем релевантнее
+    terms = query_terms(q)
+    if not terms:
+        raise ValueError("пустой поисковый запрос")
+    expression = match_expression(terms, dialect)
+    if dialect == "sqlite":
+        # bm25 — чем меньше, тем лучше; меняем знак
+        score = -func.bm25(literal_column("cars_fts"), *FTS_WEIGHTS)
+        query = select(cars_fts.c.rowid.label("car_id"), score.label("score")).where(
+            literal_column("cars_fts").op("MATCH")(expression)
+        )
+    else:
+        from sqlalchemy.dialects.mysql import match
+        score = match(*[getattr(Car, c) for c in FTS_COLUMNS], against=expression).in_boolean_mode()
+        query = select(Car.car_id.label("car_id"), score.label("score")).where(score > 0)
+    return query.subquery("matches")
+
+
+def text_condition(q: str, dialect: str):
+    # Совпадение по тексту как обычный фильтр (для сортировок car_search)
+    matches = scored_matches(q, dialect)
+    return Car.car_id.in_(select(matches.c.car_id))
+
+
+def text_search(db: Session, q: str, filters: dict, limit: int = 20, cursor: str = None) -> dict:
+    # Выдача по релевантности; курсор — (score, car_id) последней строки
+    limit = max(1, min(limit, MAX_LIMIT))
+    matches = scored_matches(q, db.get_bind().dialect.name)
+
+    query = apply_filters(select(Car, matches.c.score).join(matches, matches.c.car_id == Car.car_id), filters)
+    if cursor:
+        last = decode_cursor(cursor, "relevance", [float, int])
+        query = query.where(tuple_(matches.c.score, Car.car_id) < tuple_(*last))
+    query = query.order_by(matches.c.score.desc(), Car.car_id.desc()).limit(limit + 1)
+    rows = db.execute(query).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("relevance", [rows[-1].score, rows[-1].Car.car_id])
+
+    photos = photos_for(db, [r.Car.car_id for r in rows])
+    items = []
+    for car, score in rows:
+        item = format_car_dict(car, photos.get(car.car_id, []))
+        item["score"] = round(float(score), 4)
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true', help='перестроить индекс по таблице cars')
+    parser.add_argument('--query', help='пробный поиск')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.rebuild:
+        rebuild()
+    else:
+        ensure_fts()
+    print(f"✅ Индекс готов за {time.perf_counter() - started:.1f} с")
+
+    if args.query:
+        from models import Session as DBSession
+        db = DBSession()
+        try:
+            for item in text_search(db, args.query, {}, limit=10)["items"]:
+                print(f"  {item['score']:8.3f}  #{item['car_id']} {item['brand']} {item['model']}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
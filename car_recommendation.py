@@ -1,65 +1,19 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from collections import Counter, OrderedDict, deque, namedtuple
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.metrics.pairwise import cosine_similarity
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from models import Car, Favorite, User, Session as DBSession
-
-# -----------------------------
-# Функция для получения данных из БД
-# -----------------------------
-def get_cars_data(db: Session, user_id: int):
-    # Все автомобили на продаже
-    cars_for_sale = db.query(Car).all()
-    df_sale = pd.DataFrame([{
-        'car_id': c.car_id,
-        'brand': c.brand,
-        'bodyType': c.bodytype,
-        'fuelType': c.fuel_type,
-        'vehicleTransmission': c.vehicle_transmission,
-        'color': c.color,
-        'wheel': c.wheel,
-        'price_range': c.price_range,
-        'enginePower': float(c.engine_power) if c.engine_power else 0,
-        'productionDate': c.production_date if c.production_date else 0
-    } for c in cars_for_sale])
-
-    # Машины, которые пользователь лайкнул
-    liked_cars = (
-        db.query(Car)
-        .join(Favorite, Favorite.car_id == Car.car_id)
-        .filter(Favorite.user_id == user_id)
-        .all()
-    )
-    df_likes = pd.DataFrame([{
-        'car_id': c.car_id,
-        'brand': c.brand,
-        'bodyType': c.bodytype,
-        'fuelType': c.fuel_type,
-        'vehicleTransmission': c.vehicle_transmission,
-        'color': c.color,
-        'wheel': c.wheel,
-        'price_range': c.price_range,
-        'enginePower': float(c.engine_power) if c.engine_power else 0,
-        'productionDate': c.production_date if c.production_date else 0
-    } for c in liked_cars])
-
-    # Машины пользователя на продаже
-    user_cars = db.query(Car).filter(Car.seller_id == user_id).all()
-    df_user_sales = pd.DataFrame([{
-        'car_id': c.car_id,
-        'brand': c.brand,
-        'bodyType': c.bodytype,
-        'fuelType': c.fuel_type,
-        'vehicleTransmission': c.vehicle_transmission,
-        'color': c.color,
-        'wheel': c.wheel,
-        'price_range': c.price_range,
-        'enginePower': float(c.engine_power) if c.engine_power else 0,
-        'productionDate': c.production_date if c.production_date else 0
-    } for c in user_cars])
-
-    return df_sale, df_likes, df_user_sales
+from models import Car, Favorite, User, Recommendation, Session as DBSession
+from serializers import format_car_dict
+from ann_index import LSHIndex
 
 # -----------------------------
 # Функции для обработки признаков
@@ -91,103 +45,697 @@ weights = {
     'wheel': 0.3
 }
 
+# Строки cars читаем через Core, без создания ORM-объектов:
+# у Row те же имена атрибутов, что и у Car
+def load_car_rows(db: Session, car_ids=None):
+    query = select(Car.__table__)
+    if car_ids is not None:
+        query = query.where(Car.car_id.in_(car_ids))
+    return db.execute(query).all()
+
+
+def car_to_features(c) -> dict:
+    # c — объект Car или строка запроса по car_columns
+    return {
+        'car_id': c.car_id,
+        'brand': c.brand,
+        'bodyType': c.bodytype,
+        'fuelType': c.fuel_type,
+        'vehicleTransmission': c.vehicle_transmission,
+        'color': c.color,
+        'wheel': c.wheel,
+        'price_range': c.price_range if c.price_range else 0,
+        'enginePower': float(c.engine_power) if c.engine_power else 0,
+        'productionDate': c.production_date if c.production_date else 0
+    }
+
+
+def features_frame(rows) -> pd.DataFrame:
+    return pd.DataFrame(
+        [car_to_features(c) for c in rows],
+        columns=['car_id'] + categorical_features + numeric_features
+    )
+
+
+def make_encoder():
+    return OneHotEncoder(handle_unknown='ignore', sparse_output=True)
+
 def encode_cars(df, ohe, scaler):
+    # CSR: one-hot колонки почти пустые, плотная матрица тут не нужна
     cat_encoded = ohe.transform(df[categorical_features])
-    num_scaled = scaler.transform(df[numeric_features])
-    return np.hstack([cat_encoded, num_scaled])
-
-def apply_feature_weights(encoded_matrix, encoder, numeric_features, weights):
-    ohe_feature_names = encoder.get_feature_names_out(categorical_features)
-    all_feature_names = list(ohe_feature_names) + numeric_features
-
-    feature_weights = np.ones(len(all_feature_names))
-    for name, weight in weights.items():
-        for i, fname in enumerate(all_feature_names):
-            if fname in numeric_features:
-                if fname == name:
-                    feature_weights[i] = weight
-            else:
-                prefix = fname.split('_', 1)[0]
-                if prefix == name:
-                    feature_weights[i] = weight
-    weighted = encoded_matrix * feature_weights
-    return weighted
+    num_scaled = sparse.csr_matrix(scaler.transform(df[numeric_features]))
+    return sparse.hstack([cat_encoded, num_scaled], format='csr')
+
+def feature_weight_vector(encoder, numeric_features, weights):
+    # Считается один раз на fit кодировщика: каждая one-hot колонка
+    # получает вес своего признака
+    parts = [
+        np.full(len(cats), weights.get(name, 1.0))
+        for name, cats in zip(categorical_features, encoder.categories_)
+    ]
+    parts.append(np.array([weights.get(name, 1.0) for name in numeric_features]))
+    return np.concatenate(parts)
+
+def apply_feature_weights(encoded_matrix, feature_weights):
+    # умножение на диагональную матрицу сохраняет CSR
+    return (encoded_matrix @ sparse.diags(feature_weights)).tocsr()
+
+def row_norms(matrix):
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+def cosine_scores(matrix, norms, profile):
+    # косинусное сходство как sparse матрица × вектор
+    profile_norm = np.linalg.norm(profile)
+    scores = matrix @ profile
+    denom = norms * profile_norm
+    return np.divide(scores, denom, out=np.zeros_like(scores), where=denom > 0)
+
+def top_k_rows(scores, allowed, k):
+    # Частичный отбор вместо полной сортировки: argpartition за O(n),
+    # сортируются только k победителей
+    candidates = np.flatnonzero(allowed)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return candidates[:0]
+    candidate_scores = scores[candidates]
+    best = np.argpartition(-candidate_scores, k - 1)[:k]
+    best = best[np.argsort(-candidate_scores[best], kind='stable')]
+    return candidates[best]
+
+# -----------------------------
+# Индекс инвентаря
+# -----------------------------
+IndexSnapshot = namedtuple(
+    'IndexSnapshot', ['car_ids', 'features', 'matrix', 'norms', 'allowed', 'payloads', 'ann']
+)
+
+# Инвентарь кодируется один раз, дальше create_car / delete_car
+# применяют к нему дельты. Полная перестройка нужна только если
+# индекс устарел (max_age) или накопилось много новых категорий,
+# которых не видел OneHotEncoder. Такая перестройка идёт в фоновом
+# потоке без блокировки: новый индекс собирается отдельно, догоняет
+# журнал дельт и подменяет текущий под блокировкой. Запросы всё это
+# время читают текущий индекс. Синхронно строится только первый индекс.
+#
+# ann_mode='lsh' включает приближённый поиск (ann_index.LSHIndex) для
+# инвентаря от ann_min_size машин; на меньших объёмах — точный поиск.
+class InventoryIndex:
+    def __init__(self, max_age: float = 900, max_unknown: int = 50, compact_ratio: float = 0.25,
+                 ann_mode: str = '', ann_min_size: int = 200000, ann_params: dict = None):
+        self.max_age = max_age
+        self.max_unknown = max_unknown
+        self.compact_ratio = compact_ratio
+        self.ann_mode = ann_mode
+        self.ann_min_size = ann_min_size
+        self.ann_params = ann_params or {}
+
+        # журнал дельт (seq, 'add' | 'remove', car_id): по нему копии
+        # индекса в других процессах догоняют этот (recommendation_pool)
+        self.change_seq = 0
+        self.changes = deque(maxlen=1024)
+
+        self._lock = threading.RLock()
+        self._rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        self.ohe = None
+        self.scaler = None
+        self.features = None      # DataFrame признаков, строка = строка матрицы
+        self.matrix = None        # взвешенная CSR-матрица признаков
+        self.norms = np.empty(0)  # нормы строк матрицы для косинуса
+        self.feature_weights = None
+        self.car_ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.row_of = {}
+        self.payloads = {}        # car_id -> карточка машины для API
+        self.ann = None
+
+        self._pending = []        # (features dict, вектор) ещё не влитые в матрицу
+        self._cold = None         # рейтинг для cold start: {bodytype | None: car_ids}
+        self.built_at = None
+        self.build_seconds = 0.0
+        self.load_seconds = 0.0
+        self.generation = 0
+        self.added_since_build = 0
+        self.removed_since_build = 0
+        self.unknown_since_build = 0
+
+    # --- построение ---
+    def build(self, db: Session):
+        started = time.perf_counter()
+        rows = load_car_rows(db)
+        load_seconds = time.perf_counter() - started
+        df = features_frame(rows)
+        payloads = {r.car_id: format_car_dict(r, []) for r in rows}
+        self.build_from_frame(df, payloads, started)
+        self.load_seconds = load_seconds
+
+    def build_from_frame(self, df: pd.DataFrame, payloads: dict = None, started: float = None):
+        started = time.perf_counter() if started is None else started
+        with self._lock:
+            generation = self.generation
+            self._reset()
+            self.generation = generation + 1
+
+            if not df.empty:
+                self.ohe = make_encoder()
+                self.ohe.fit(df[categorical_features])
+                self.scaler = StandardScaler()
+                self.scaler.fit(df[numeric_features])
+                self.feature_weights = feature_weight_vector(self.ohe, numeric_features, weights)
+                self.matrix = self._encode(df)
+                self.norms = row_norms(self.matrix)
+                self._build_ann()
+
+            self.features = df
+            self.payloads = payloads if payloads is not None else {}
+            self.car_ids = df['car_id'].to_numpy(dtype=np.int64)
+            self.alive = np.ones(len(df), dtype=bool)
+            self.row_of = {int(cid): i for i, cid in enumerate(self.car_ids)}
+            self.built_at = time.time()
+            self.build_seconds = time.perf_counter() - started
+
+    def _build_ann(self):
+        self.ann = None
+        if self.ann_mode == 'lsh' and self.matrix.shape[0] >= self.ann_min_size:
+            self.ann = LSHIndex(**self.ann_params).build(self.matrix)
+
+    def ensure(self, db: Session):
+        with self._lock:
+            if not self.is_stale():
+                return
+            if self.built_at is not None and not self._needs_fit():
+                # текущим индексом ещё можно отвечать
+                self._start_rebuild()
+                return
+            self.build(db)
+
+    def _needs_fit(self) -> bool:
+        # без кодировщика (пустой инвентарь) любая новая машина требует fit
+        return self.ohe is None and bool(len(self.car_ids) or self._pending)
+
+    def is_stale(self) -> bool:
+        if self.built_at is None:
+            return True
+        if self.max_age and time.time() - self.built_at > self.max_age:
+            return True
+        if self._needs_fit():
+            return True
+        return self.unknown_since_build > self.max_unknown
+
+    def _start_rebuild(self):
+        # под self._lock; одна фоновая перестройка за раз
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+        threading.Thread(target=self._rebuild, name="inventory-index-rebuild", daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self._lock:
+                seq = self.change_seq
+            fresh = InventoryIndex(
+                self.max_age, self.max_unknown, self.compact_ratio, self.ann_mode, self.ann_min_size, self.ann_params
+            )
+            db = DBSession()
+            try:
+                fresh.build(db)
+                # догоняем дельты, пришедшие во время сборки: машины читаем
+                # без блокировки, подменяем, когда догонять больше нечего
+                while True:
+                    with self._lock:
+                        changes = [c for c in self.changes if c[0] > seq]
+                        if changes and changes[0][0] > seq + 1:
+                            print("Индекс рекомендаций: журнал дельт переполнен, перестройка повторится")
+                            return
+                        if not changes:
+                            self._adopt(fresh)
+                            return
+                    for seq, op, car_id in changes:
+                        if op == 'remove':
+                            fresh.remove_car(car_id)
+                        else:
+                            rows = load_car_rows(db, [car_id])
+                            if rows:
+                                fresh.add_car(rows[0])
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"Ошибка фоновой перестройки индекса рекомендаций: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _adopt(self, fresh):
+        # под self._lock: состояние собранного индекса; журнал дельт свой
+        generation = self.generation
+        for name, value in vars(fresh).items():
+            if name not in ('_lock', '_rebuilding', 'change_seq', 'changes'):
+                setattr(self, name, value)
+        self.generation = generation + 1
+
+    def _encode(self, df):
+        return apply_feature_weights(encode_cars(df, self.ohe, self.scaler), self.feature_weights)
+
+    def _has_unknown(self, features: dict) -> bool:
+        for name, cats in zip(categorical_features, self.ohe.categories_):
+            if features[name] not in cats:
+                return True
+        return False
+
+    # --- дельты ---
+    def _log_change(self, op: str, car_id: int):
+        self.change_seq += 1
+        self.changes.append((self.change_seq, op, int(car_id)))
+
+    def add_car(self, car):
+        with self._lock:
+            self._log_change('add', car.car_id)
+            if self.built_at is None:
+                return
+            self._cold = None
+            features = car_to_features(car)
+            if car.car_id in self.row_of:
+                self._remove(car.car_id)
+            vector = None
+            if self.ohe is not None:
+                if self._has_unknown(features):
+                    self.unknown_since_build += 1
+                vector = self._encode(pd.DataFrame([features]))
+            self._pending.append((features, vector))
+            self.row_of[int(car.car_id)] = len(self.car_ids) + len(self._pending) - 1
+            self.payloads[int(car.car_id)] = format_car_dict(car, [])
+            self.added_since_build += 1
+
+    def remove_car(self, car_id: int):
+        with self._lock:
+            self._log_change('remove', car_id)
+            self._remove(car_id)
+
+    def _remove(self, car_id: int):
+        with self._lock:
+            row = self.row_of.pop(int(car_id), None)
+            if row is None:
+                return
+            self._cold = None
+            self.payloads.pop(int(car_id), None)
+            self._merge_pending()
+            self.alive[row] = False
+            self.removed_since_build += 1
+            if (~self.alive).sum() > self.compact_ratio * max(len(self.alive), 1):
+                self._compact()
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        rows = pd.DataFrame([f for f, _ in self._pending], columns=self.features.columns)
+        self.features = pd.concat([self.features, rows], ignore_index=True)
+        if self.ohe is not None:
+            added = sparse.vstack([v for _, v in self._pending], format='csr')
+            if self.ann is not None:
+                self.ann.add(self.matrix.shape[0], added)
+            self.matrix = sparse.vstack([self.matrix, added], format='csr')
+            self.norms = np.concatenate([self.norms, row_norms(added)])
+        self.car_ids = np.concatenate([self.car_ids, rows['car_id'].to_numpy(dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+        self._pending = []
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive)
+        self.features = self.features.iloc[keep].reset_index(drop=True)
+        if self.matrix is not None:
+            self.matrix = self.matrix[keep]
+            self.norms = self.norms[keep]
+            self._build_ann()
+        self.car_ids = self.car_ids[keep]
+        self.alive = np.ones(len(self.car_ids), dtype=bool)
+        self.row_of = {int(cid): i for i, cid in enumerate(self.car_ids)}
+
+    # --- чтение ---
+    def snapshot(self, exclude_ids=()):
+        # Срез для одного запроса без копирования матрицы: новые машины
+        # вливаются в новые массивы. allowed — живые строки без исключённых.
+        with self._lock:
+            self._merge_pending()
+            allowed = self.alive.copy()
+            allowed[self.rows_for(exclude_ids)] = False
+            return IndexSnapshot(
+                self.car_ids, self.features, self.matrix, self.norms, allowed, self.payloads, self.ann
+            )
+
+    def cold_start_ranking(self, bodytype: str = None):
+        # Рейтинг по цене / новизне пересчитывается один раз после
+        # изменения объявлений; запрос получает готовый срез
+        with self._lock:
+            if self._cold is None:
+                self._merge_pending()
+                self._cold = self._build_cold_ranking()
+            return self._cold.get(bodytype, self.car_ids[:0])
+
+    def _build_cold_ranking(self):
+        rows = np.flatnonzero(self.alive)
+        price = self.features['price_range'].to_numpy(dtype=float)[rows]
+        year = self.features['productionDate'].to_numpy(dtype=float)[rows]
+        # сначала дешевле, при равной цене — новее
+        order = rows[np.lexsort((-year, price))]
+        ranked_ids = self.car_ids[order]
+
+        rankings = {None: ranked_ids}
+        body = self.features['bodyType'].to_numpy()[order]
+        for value in pd.unique(body):
+            if value is not None:
+                rankings[value] = ranked_ids[body == value]
+        return rankings
+
+    def rows_for(self, car_ids):
+        return [self.row_of[cid] for cid in car_ids if cid in self.row_of]
+
+    def vectors_for(self, db: Session, car_ids):
+        # Векторы для лайков/продаж пользователя. Машины, которых нет
+        # в индексе (добавлены другим процессом), кодируем на лету.
+        with self._lock:
+            self._merge_pending()
+            rows = self.rows_for(car_ids)
+            vectors = [self.matrix[rows]] if rows else []
+            missing = [cid for cid in car_ids if cid not in self.row_of]
+            ohe, scaler, feature_weights = self.ohe, self.scaler, self.feature_weights
+
+        if missing:
+            df = features_frame(load_car_rows(db, missing))
+            if not df.empty:
+                counts = pd.Series(missing).value_counts()
+                df = df.loc[df.index.repeat(df['car_id'].map(counts))]
+                vectors.append(apply_feature_weights(encode_cars(df, ohe, scaler), feature_weights))
+        return vectors
+
+    def changes_after(self, seq: int):
+        with self._lock:
+            return self.change_seq, [c for c in self.changes if c[0] > seq]
+
+    def vector_of(self, car_id: int):
+        with self._lock:
+            self._merge_pending()
+            row = self.row_of.get(int(car_id))
+            if row is None or self.matrix is None:
+                return None
+            return self.matrix[row].toarray().ravel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": int(self.alive.sum()) + len(self._pending),
+                "features": int(self.matrix.shape[1]) if self.matrix is not None else 0,
+                "generation": self.generation,
+                "built_at": self.built_at,
+                "build_seconds": round(self.build_seconds, 4),
+                "load_seconds": round(self.load_seconds, 4),
+                "age_seconds": round(time.time() - self.built_at, 1) if self.built_at else None,
+                "added_since_build": self.added_since_build,
+                "removed_since_build": self.removed_since_build,
+                "unknown_categories_since_build": self.unknown_since_build,
+                "stale": self.is_stale(),
+                "rebuilding": self._rebuilding,
+                "ann": self.ann.stats() if self.ann is not None else None,
+            }
+
+
+inventory_index = InventoryIndex(
+    max_age=float(os.getenv("RECOMMENDER_INDEX_MAX_AGE", "900")),
+    ann_mode=os.getenv("RECOMMENDER_ANN", ""),
+    ann_min_size=int(os.getenv("RECOMMENDER_ANN_MIN_SIZE", "200000")),
+    ann_params={
+        "n_tables": int(os.getenv("RECOMMENDER_ANN_TABLES", "16")),
+        "n_bits": int(os.getenv("RECOMMENDER_ANN_BITS", "12")),
+        "probes": int(os.getenv("RECOMMENDER_ANN_PROBES", "1")),
+    }
+)
+
+# -----------------------------
+# Кэш профилей пользователей
+# -----------------------------
+# Профиль = сумма и количество взвешенных векторов лайков и продаж.
+# Эндпоинты избранного и объявлений обновляют его инкрементально,
+# поэтому повторный заход на главную платит только за сходство.
+# TTL ограничивает устаревание, если данные поменял другой процесс.
+class ProfileEntry:
+    def __init__(self, generation, liked, own, total, count):
+        self.generation = generation
+        self.liked = liked        # Counter car_id -> сколько раз в избранном
+        self.own = own            # Counter car_id -> своё объявление
+        self.total = total        # сумма векторов (dense) или None
+        self.count = count
+        self.created_at = time.time()
+
+    @property
+    def exclude_ids(self):
+        return list(self.liked) + list(self.own)
+
+    @property
+    def car_ids(self):
+        # с повторами: из них строится профиль
+        return list(self.liked.elements()) + list(self.own.elements())
+
+    def profile(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+
+class ProfileCache:
+    def __init__(self, index: InventoryIndex, max_size: int = 5000, ttl: float = 300):
+        self.index = index
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (
+                entry.generation != self.index.generation
+                or time.time() - entry.created_at > self.ttl
+            ):
+                del self._entries[user_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def load(self, db: Session, user_id: int) -> ProfileEntry:
+        generation = self.index.generation
+        # избранное, оставшееся от удалённых машин, в профиль не попадает
+        liked = Counter(
+            r.car_id for r in db.query(Favorite.car_id)
+            .join(Car, Car.car_id == Favorite.car_id)
+            .filter(Favorite.user_id == user_id)
+        )
+        own = Counter(r.car_id for r in db.query(Car.car_id).filter(Car.seller_id == user_id))
+
+        total, count = None, 0
+        user_vectors = self.index.vectors_for(db, ProfileEntry(None, liked, own, None, 0).car_ids)
+        if user_vectors:
+            stacked = sparse.vstack(user_vectors)
+            total = np.asarray(stacked.sum(axis=0)).ravel()
+            count = stacked.shape[0]
+
+        entry = ProfileEntry(generation, liked, own, total, count)
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def add_car(self, user_id: int, car_id: int, kind: str = 'liked'):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            vector = self.index.vector_of(car_id)
+            if vector is None or entry.generation != self.index.generation:
+                self._drop(user_id)
+                return
+            getattr(entry, kind)[car_id] += 1
+            entry.total = vector if entry.total is None else entry.total + vector
+            entry.count += 1
+            self.updates += 1
+
+    def remove_car(self, user_id: int, car_id: int, kind: str = 'liked'):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            times = getattr(entry, kind).pop(car_id, 0)
+            if not times:
+                return
+            vector = self.index.vector_of(car_id)
+            if vector is None or entry.total is None or entry.generation != self.index.generation:
+                self._drop(user_id)
+                return
+            entry.total = entry.total - times * vector
+            entry.count -= times
+            self.updates += 1
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._drop(user_id)
+
+    def _drop(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "updates": self.updates,
+                "invalidations": self.invalidations,
+            }
+
+
+profile_cache = ProfileCache(
+    inventory_index,
+    max_size=int(os.getenv("RECOMMENDER_PROFILE_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("RECOMMENDER_PROFILE_CACHE_TTL", "300"))
+)
+
+# -----------------------------
+# Готовые рекомендации из офлайн-расчёта
+# -----------------------------
+PRECOMPUTED_MAX_AGE = float(os.getenv("RECOMMENDATIONS_MAX_AGE", str(6 * 3600)))
+
+# откуда отдавались рекомендации: precomputed / online / cold_start
+serving_stats = Counter()
+
+
+def load_precomputed(db: Session, user_id: int, top_n: int):
+    row = db.get(Recommendation, user_id)
+    if row is None:
+        return None
+    if datetime.now() - row.generated_at > timedelta(seconds=PRECOMPUTED_MAX_AGE):
+        return None
+    result = payloads_for(inventory_index.payloads, json.loads(row.car_ids)[:top_n])
+    # часть машин уже снята с продажи — досчитываем онлайн
+    if len(result) < top_n:
+        return None
+    return result
+
+
+def invalidate_precomputed(db: Session, user_id: int):
+    # профиль изменился — готовый список больше не актуален;
+    # выполняется в транзакции вызывающего эндпоинта
+    db.query(Recommendation).filter(Recommendation.user_id == user_id).delete()
+
 
 # -----------------------------
 # Основная функция рекомендаций
 # -----------------------------
-def get_car_recommendations(user_id: int, top_n: int = 20):
+def get_car_recommendations(user_id: int, top_n: int = 20, bodytype: str = None, scorer=None):
+    # Возвращает готовые карточки машин (format_car_dict) в порядке рекомендаций.
+    # scorer — внешний скоринг (recommendation_pool.ScoringPool.score);
+    # если он вернул None, отдаём cold start.
     db = DBSession()
-    df_sale, df_likes, df_user_sales = get_cars_data(db, user_id)
+    try:
+        inventory_index.ensure(db)
 
-    # ❗ Нет машин в продаже вообще
-    if df_sale.empty:
+        # офлайн-список не знает о фильтре по кузову
+        precomputed = load_precomputed(db, user_id, top_n) if bodytype is None else None
+        if precomputed is not None:
+            serving_stats['precomputed'] += 1
+            return precomputed
+
+        # Профиль (лайки + продажи) берём из кэша, при промахе — из БД
+        entry = profile_cache.get(user_id)
+        if entry is None:
+            entry = profile_cache.load(db, user_id)
+    finally:
         db.close()
-        return []
 
     # -----------------------------
     # Cold start: нет лайков и продаж
     # -----------------------------
-    if df_likes.empty and df_user_sales.empty:
-        # fallback: просто топ по цене / новизне
-        fallback = (
-            df_sale
-            .sort_values(
-                by=['price_range', 'productionDate'],
-                ascending=[True, False]
-            )
-            .head(top_n)
-        )
-        db.close()
-        return fallback['car_id'].tolist()
+    if not entry.liked and not entry.own:
+        # fallback: просто топ по цене / новизне, готовый срез
+        serving_stats['cold_start'] += 1
+        return cold_start_recommendations(top_n, bodytype)
 
-    # -----------------------------
-    # Подготовка кодировщиков
-    # -----------------------------
-    all_cars = pd.concat(
-        [df_sale, df_likes, df_user_sales],
-        ignore_index=True
-    )
+    user_profile = entry.profile()
+    if user_profile is None:
+        # ни у одной машины профиля нет вектора (сняты с продажи) — как cold start
+        serving_stats['cold_start'] += 1
+        return cold_start_recommendations(top_n, bodytype, entry.exclude_ids)
 
-    ohe = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-    ohe.fit(all_cars[categorical_features])
+    if scorer is not None:
+        car_ids = scorer(entry.car_ids, entry.exclude_ids, top_n, bodytype)
+        if car_ids is None:
+            serving_stats['cold_start_fallback'] += 1
+            return cold_start_recommendations(top_n, bodytype, entry.exclude_ids)
+        serving_stats['online'] += 1
+        return payloads_for(inventory_index.payloads, car_ids)
 
-    scaler = StandardScaler()
-    scaler.fit(all_cars[numeric_features])
+    # Свои и уже лайкнутые машины исключаем до ранжирования
+    snap = inventory_index.snapshot(exclude_ids=entry.exclude_ids)
+    if bodytype is not None:
+        snap = snap._replace(allowed=snap.allowed & (snap.features['bodyType'].to_numpy() == bodytype))
 
-    X_sale = encode_cars(df_sale, ohe, scaler)
-    X_sale_w = apply_feature_weights(X_sale, ohe, numeric_features, weights)
+    # ❗ Нет машин в продаже вообще
+    if not snap.allowed.any():
+        return []
 
-    user_vectors = []
+    best_rows = rank_rows(snap, user_profile, top_n)
+    serving_stats['online'] += 1
+    return payloads_for(snap.payloads, snap.car_ids[best_rows])
 
-    # Если есть лайки — добавляем
-    if not df_likes.empty:
-        X_likes = encode_cars(df_likes, ohe, scaler)
-        X_likes_w = apply_feature_weights(X_likes, ohe, numeric_features, weights)
-        user_vectors.append(X_likes_w)
 
-    # Если есть продажи — добавляем
-    if not df_user_sales.empty:
-        X_sales = encode_cars(df_user_sales, ohe, scaler)
-        X_sales_w = apply_feature_weights(X_sales, ohe, numeric_features, weights)
-        user_vectors.append(X_sales_w)
+def cold_start_recommendations(top_n: int, bodytype: str = None, exclude_ids=()):
+    ranking = inventory_index.cold_start_ranking(bodytype)
+    if not exclude_ids:
+        return payloads_for(inventory_index.payloads, ranking[:top_n])
+    exclude = set(exclude_ids)
+    # исключённых не больше len(exclude): этого среза хватит
+    head = ranking[:top_n + len(exclude)]
+    return payloads_for(inventory_index.payloads, [c for c in head if int(c) not in exclude][:top_n])
 
-    # -----------------------------
-    # Профиль пользователя
-    # -----------------------------
-    user_profile = np.mean(np.vstack(user_vectors), axis=0)
 
+def rank_rows(snap, profile, top_n: int, exact: bool = False):
     # -----------------------------
     # Сходство
     # -----------------------------
-    similarities = cosine_similarity([user_profile], X_sale_w)[0]
-    df_sale['similarity'] = similarities
+    if snap.ann is not None and not exact:
+        candidates = snap.ann.candidates(profile)
+        candidates = candidates[candidates < len(snap.allowed)]
+        candidates = candidates[snap.allowed[candidates]]
+        # кандидатов не хватило — честно досчитываем точным поиском
+        if len(candidates) >= top_n:
+            scores = cosine_scores(snap.matrix[candidates], snap.norms[candidates], profile)
+            best = top_k_rows(scores, np.ones(len(candidates), dtype=bool), top_n)
+            return candidates[best]
+
+    similarities = cosine_scores(snap.matrix, snap.norms, profile)
+    return top_k_rows(similarities, snap.allowed, top_n)
 
-    recommendations = (
-        df_sale
-        .sort_values('similarity', ascending=False)
-        .head(top_n)
-    )
 
-    db.close()
-    return recommendations['car_id'].tolist()
+def payloads_for(payloads, car_ids):
+    result = []
+    for car_id in car_ids:
+        payload = payloads.get(int(car_id))
+        if payload is not None:
+            result.append(payload)
+    return result
@@ -0,0 +1,150 @@
+import base64
+import json
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from models import Car, Photo
+from serializers import format_car_dict
+
+# -----------------------------
+# Поиск машин с keyset-пагинацией
+# -----------------------------
+# Вместо OFFSET страница продолжается с последней строки предыдущей:
+# WHERE (sort_col, car_id) > (:last_value, :last_id) ORDER BY sort_col, car_id.
+# Стоимость страницы не зависит от её номера — только от фильтров.
+# Курсор непрозрачный: base64 от JSON {сортировка, значения последней строки}.
+#
+# Сортировки идут по индексированным колонкам (индексы в models.Car).
+# Строки с NULL в колонке сортировки в такую выдачу не попадают:
+# без цены машину нельзя поставить в ряд по цене.
+
+MAX_LIMIT = 100
+
+# сортировка -> (колонка, по убыванию); вторым ключом всегда car_id
+SORTS = {
+    "newest": (None, True),
+    "price_asc": (Car.price, False),
+    "price_desc": (Car.price, True),
+    "year_desc": (Car.production_date, True),
+    "year_asc": (Car.production_date, False),
+    "mileage_asc": (Car.mileage, False),
+}
+
+EQUALITY_FILTERS = {
+    "brand": Car.brand,
+    "model": Car.model,
+    "bodytype": Car.bodytype,
+    "fuel_type": Car.fuel_type,
+    "vehicle_transmission": Car.vehicle_transmission,
+}
+
+RANGE_FILTERS = {
+    "price": Car.price,
+    "year": Car.production_date,
+    "mileage": Car.mileage,
+}
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    values = [float(v) if isinstance(v, Decimal) else v for v in values]
+    raw = json.dumps({"s": sort, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def cursor_value_ok(value, kind: type) -> bool:
+    # kind — int (целочисленная колонка) или float (цена, релевантность).
+    # NULL в колонках курсора не бывает: такие строки в выдачу не попадают
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    if kind is int:
+        return isinstance(value, int)
+    return math.isfinite(value)
+
+
+def decode_cursor(cursor: str, sort: str, kinds: list) -> list:
+    # kinds — ожидаемый тип каждого значения курсора, по колонкам сортировки
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = data["v"]
+    except Exception:
+        raise ValueError("некорректный курсор")
+    if data.get("s") != sort or not isinstance(values, list) or len(values) != len(kinds):
+        raise ValueError("курсор от другой сортировки")
+    if not all(cursor_value_ok(v, kind) for v, kind in zip(values, kinds)):
+        raise ValueError("некорректный курсор")
+    return values
+
+
+def column_kind(column) -> type:
+    return int if column.type.python_type is int else float
+
+
+def sort_columns(sort: str) -> list:
+    column, _ = SORTS[sort]
+    return [Car.car_id] if column is None else [column, Car.car_id]
+
+
+def apply_filters(query, filters: dict):
+    # filters: brand=..., price_min=..., year_max=... ; None — фильтра нет
+    for name, column in EQUALITY_FILTERS.items():
+        value = filters.get(name)
+        if value is not None:
+            query = query.where(column == value)
+    for name, column in RANGE_FILTERS.items():
+        low, high = filters.get(f"{name}_min"), filters.get(f"{name}_max")
+        if low is not None:
+            query = query.where(column >= low)
+        if high is not None:
+            query = query.where(column <= high)
+    return query
+
+
+def search_query(filters: dict, sort: str = "newest", limit: int = 20, cursor: str = None, conditions=()):
+    if sort not in SORTS:
+        raise ValueError(f"неизвестная сортировка: {sort}")
+    column, descending = SORTS[sort]
+    columns = sort_columns(sort)
+
+    query = apply_filters(select(Car), filters).where(*conditions)
+    if column is not None:
+        query = query.where(column.isnot(None))
+    if cursor:
+        last = tuple_(*columns)
+        values = tuple_(*decode_cursor(cursor, sort, [column_kind(c) for c in columns]))
+        query = query.where(last < values if descending else last > values)
+    order = [c.desc() if descending else c.asc() for c in columns]
+    # одна лишняя строка — узнать, есть ли следующая страница
+    return query.order_by(*order).limit(limit + 1)
+
+
+def photos_for(db: Session, car_ids: list) -> dict:
+    photos = defaultdict(list)
+    if car_ids:
+        rows = db.execute(select(Photo.car_id, Photo.photo_url).where(Photo.car_id.in_(car_ids)))
+        for car_id, photo_url in rows:
+            photos[car_id].append({"photo_url": photo_url})
+    return photos
+
+
+def search_cars(db: Session, filters: dict, sort: str = "newest", limit: int = 20, cursor: str = None,
+                conditions=()) -> dict:
+    # conditions — дополнительные WHERE, например совпадение по тексту (car_fts)
+    limit = max(1, min(limit, MAX_LIMIT))
+    cars = db.execute(search_query(filters, sort, limit, cursor, conditions)).scalars().all()
+
+    next_cursor = None
+    if len(cars) > limit:
+        cars = cars[:limit]
+        last = cars[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, c.key) for c in sort_columns(sort)])
+
+    photos = photos_for(db, [c.car_id for c in cars])
+    return {
+        "items": [format_car_dict(c, photos.get(c.car_id, [])) for c in cars],
+        "next_cursor": next_cursor,
+    }
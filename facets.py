@@ -0,0 +1,229 @@
+import argparse
+import os
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from car_search import apply_filters
+from models import Car, FacetCount, engine as default_engine, is_built, mark_built
+from price_bands import price_bands
+
+# -----------------------------
+# Фасеты поиска: "Toyota (1 204)"
+# -----------------------------
+# Счётчики хранятся в facet_counts и обновляются в той же транзакции,
+# что и сами машины: create_car, delete_car, import_cars.py.
+# На каждую машину — строки (фасет, значение) по всему каталогу и
+# попарные: (фильтр-фасет = значение) × (другой фасет, значение).
+#
+# Чтение:
+#   - без фильтров или с одним фильтром по фасету — готовые строки
+#     facet_counts, точные и за один запрос по первичному ключу;
+#   - любые другие фильтры — GROUP BY по отфильтрованным машинам, но не
+#     больше FACET_SCAN_LIMIT строк на фасет; если лимит достигнут,
+#     ответ помечается approximate (счётчики — нижняя граница).
+# Счётчик фасета считается без его собственного фильтра, чтобы в
+# интерфейсе можно было переключиться на другую марку.
+#
+# Первый полный пересчёт делают старт API и import_cars.py (отметка
+# в derived_builds). Повторный — после смены price_bands.json или правки
+# cars в обход приложения:
+#   python facets.py --rebuild
+
+FACETS = {
+    "brand": Car.brand,
+    "bodytype": Car.bodytype,
+    "fuel_type": Car.fuel_type,
+    "vehicle_transmission": Car.vehicle_transmission,
+}
+PRICE_FACET = "price_band"
+FACET_NAMES = list(FACETS) + [PRICE_FACET]
+PRICE_FILTERS = ("price_min", "price_max")
+
+SCAN_LIMIT = int(os.getenv("FACET_SCAN_LIMIT", "20000"))
+REBUILD_CHUNK = 50_000
+BUILD_NAME = "facet_counts"
+
+
+def car_facets(car) -> list:
+    # car — словарь (записи импорта) или объект / строка с атрибутами Car
+    get = car.get if isinstance(car, dict) else lambda name: getattr(car, name, None)
+    pairs = []
+    for name in FACETS:
+        value = get(name)
+        if value is not None:
+            pairs.append((name, str(value)))
+    price = get("price")
+    if price is not None:
+        pairs.append((PRICE_FACET, str(price_bands.band(float(price)))))
+    return pairs
+
+
+def count_deltas(cars, sign: int = 1) -> Counter:
+    deltas = Counter()
+    for car in cars:
+        pairs = car_facets(car)
+        for facet, value in pairs:
+            deltas[("", "", facet, value)] += sign
+        for filter_facet, filter_value in pairs:
+            # цена фильтруется диапазоном, а не значением фасета
+            if filter_facet == PRICE_FACET:
+                continue
+            for facet, value in pairs:
+                if facet != filter_facet:
+                    deltas[(filter_facet, filter_value, facet, value)] += sign
+    return deltas
+
+
+def apply_deltas(conn, deltas: Counter):
+    table = FacetCount.__table__
+    rows = [
+        {"filter_facet": ff, "filter_value": fv, "facet": f, "value": v, "count": n}
+        for (ff, fv, f, v), n in deltas.items() if n
+    ]
+    if not rows:
+        return
+    if conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key],
+            set_={"count": table.c.count + stmt.excluded["count"]},
+        )
+    else:
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        stmt = stmt.on_duplicate_key_update(count=table.c.count + stmt.inserted["count"])
+    conn.execute(stmt, rows)
+
+
+def add_cars(conn, cars):
+    apply_deltas(conn, count_deltas(cars, 1))
+
+
+def remove_cars(conn, cars):
+    apply_deltas(conn, count_deltas(cars, -1))
+
+
+def rebuild(bind=default_engine) -> int:
+    columns = [Car.car_id, Car.price, *FACETS.values()]
+    total = 0
+    with bind.begin() as conn:
+        conn.execute(delete(FacetCount))
+        deltas = Counter()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(*columns).where(Car.car_id > last_id).order_by(Car.car_id).limit(REBUILD_CHUNK)
+            ).all()
+            if not rows:
+                break
+            deltas.update(count_deltas(rows))
+            total += len(rows)
+            last_id = rows[-1].car_id
+        apply_deltas(conn, deltas)
+        mark_built(conn, BUILD_NAME)
+    return total
+
+
+def ensure_facets(bind=default_engine) -> bool:
+    # Полный пересчёт, пока facet_counts ни разу не собирался по всей cars.
+    # Пустоты таблицы мало: импорт в базу со старыми машинами до первого
+    # старта API дописал бы счётчики только новых машин
+    with bind.connect() as conn:
+        if is_built(conn, BUILD_NAME):
+            return False
+    started = time.perf_counter()
+    total = rebuild(bind)
+    if total:
+        print(f"Пересчитаны фасеты по {total} машинам за {time.perf_counter() - started:.1f} с")
+    return True
+
+
+def stored_counts(db: Session, filter_facet: str = "", filter_value: str = "") -> dict:
+    rows = db.execute(
+        select(FacetCount.facet, FacetCount.value, FacetCount.count).where(
+            FacetCount.filter_facet == filter_facet,
+            FacetCount.filter_value == filter_value,
+            FacetCount.count > 0,
+        )
+    )
+    counts = defaultdict(Counter)
+    for facet, value, count in rows:
+        counts[facet][value] = count
+    return counts
+
+
+def scan_facet(db: Session, facet: str, filters: dict, conditions=()):
+    # GROUP BY по не более чем SCAN_LIMIT отфильтрованным машинам
+    own = PRICE_FILTERS if facet == PRICE_FACET else (facet,)
+    facet_filters = {k: v for k, v in filters.items() if k not in own}
+    column = Car.price if facet == PRICE_FACET else FACETS[facet]
+
+    sample = (
+        apply_filters(select(column.label("v")), facet_filters)
+        .where(*conditions)
+        .where(column.isnot(None))
+        .limit(SCAN_LIMIT)
+        .subquery()
+    )
+    rows = db.execute(select(sample.c.v, func.count()).group_by(sample.c.v)).all()
+
+    counts = Counter()
+    for value, count in rows:
+        key = str(price_bands.band(float(value))) if facet == PRICE_FACET else str(value)
+        counts[key] += count
+    return counts, sum(counts.values()) >= SCAN_LIMIT
+
+
+def format_facets(counts: dict) -> dict:
+    result = {}
+    for facet in FACET_NAMES:
+        values = counts.get(facet, Counter())
+        if facet == PRICE_FACET:
+            result[facet] = [
+                {"value": v, "label": price_bands.label(int(v)), "count": n}
+                for v, n in sorted(values.items(), key=lambda item: int(item[0]))
+            ]
+        else:
+            result[facet] = [{"value": v, "count": n} for v, n in values.most_common()]
+    return result
+
+
+def facet_counts(db: Session, filters: dict, conditions=()) -> dict:
+    active = {k: v for k, v in filters.items() if v is not None}
+
+    if not conditions and not active:
+        return {"facets": format_facets(stored_counts(db)), "approximate": False}
+
+    if not conditions and len(active) == 1 and next(iter(active)) in FACETS:
+        filter_facet, filter_value = next(iter(active.items()))
+        counts = stored_counts(db, filter_facet, str(filter_value))
+        # свой фасет — без собственного фильтра
+        counts[filter_facet] = stored_counts(db)[filter_facet]
+        return {"facets": format_facets(counts), "approximate": False}
+
+    counts, approximate = {}, False
+    for facet in FACET_NAMES:
+        counts[facet], capped = scan_facet(db, facet, active, conditions)
+        approximate = approximate or capped
+    return {"facets": format_facets(counts), "approximate": approximate, "scan_limit": SCAN_LIMIT}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true', help='пересчитать facet_counts по таблице cars')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        started = time.perf_counter()
+        total = rebuild()
+        print(f"✅ Фасеты пересчитаны по {total} машинам за {time.perf_counter() - started:.1f} с")
+    else:
+        ensure_facets()
+
+
+if __name__ == "__main__":
+    main()
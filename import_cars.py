@@ -0,0 +1,211 @@
+import argparse
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import insert, select
+
+import facets
+import market_stats
+import price_model
+from models import (
+    engine, ensure_schema, insert_ignore,
+    Car, Brand, Model, BodyType, ImportCheckpoint,
+)
+
+# -----------------------------
+# Потоковый импорт объявлений из CSV
+# -----------------------------
+# Запуск:
+#   python import_cars.py result3.csv --chunk-size 5000
+#   python import_cars.py result3.csv --restart      # начать файл заново
+#
+# CSV читается пачками (pandas chunksize), каждая пачка — одна транзакция:
+#   - марки, модели и кузова вставляются с INSERT IGNORE;
+#   - строки с vin / state_number, которые уже есть в базе или раньше
+#     в этой же пачке, пропускаются;
+#   - price_range считается одним пакетным предсказанием модели на пачку
+#     (разница диапазонов, как в create_car);
+#   - машины вставляются bulk INSERT через Core, счётчики фасетов
+#     (facet_counts) дополняются, а модели отмечаются для пересчёта
+#     market_stats в той же транзакции;
+#   - в import_checkpoints записывается число обработанных строк файла.
+# Перед первой пачкой facet_counts и market_stats собираются по машинам,
+# уже лежащим в базе, если этого ещё не делал старт API.
+# После сбоя повторный запуск продолжает с первой незакоммиченной пачки.
+
+# колонка CSV -> колонка cars
+COLUMN_MAP = {
+    "seller_id": "seller_id",
+    "brand": "brand",
+    "model_name": "model",
+    "bodyType": "bodytype",
+    "description": "description",
+    "color": "color",
+    "engineDisplacement": "engine_displacement",
+    "enginePower": "engine_power",
+    "fuelType": "fuel_type",
+    "mileage": "mileage",
+    "productionDate": "production_date",
+    "vehicleTransmission": "vehicle_transmission",
+    "owners": "owners",
+    "drivetrains": "drive_type",
+    "wheel": "wheel",
+    "price": "price",
+    "vin": "vin",
+    "state_number": "state_number",
+    "price_range": "price_range",
+}
+INT_COLUMNS = ["seller_id", "mileage", "production_date", "owners", "price_range"]
+FLOAT_COLUMNS = ["engine_displacement", "engine_power", "price"]
+UNIQUE_COLUMNS = ["vin", "state_number"]
+
+
+def prepare_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    df = chunk.rename(columns=COLUMN_MAP)
+    df = df[[c for c in COLUMN_MAP.values() if c in df.columns]].copy()
+    for column in COLUMN_MAP.values():
+        if column not in df.columns:
+            df[column] = None
+    for column in INT_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce").round().astype("Int64")
+    for column in FLOAT_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    for column in UNIQUE_COLUMNS:
+        df[column] = df[column].astype("string").str.strip().replace("", pd.NA)
+    return df
+
+
+def drop_duplicates(conn, df: pd.DataFrame) -> pd.DataFrame:
+    # Дубликаты внутри пачки и уже загруженные vin / state_number
+    keep = pd.Series(True, index=df.index)
+    for column in UNIQUE_COLUMNS:
+        values = df[column]
+        present = values.notna()
+        keep &= ~(present & values.duplicated())
+        candidates = values[present].unique().tolist()
+        if candidates:
+            col = getattr(Car, column)
+            existing = set(conn.execute(select(col).where(col.in_(candidates))).scalars())
+            keep &= ~values.isin(existing).fillna(False)
+    return df[keep]
+
+
+def upsert_references(conn, df: pd.DataFrame):
+    brands = df["brand"].dropna().unique()
+    insert_ignore(conn, Brand.__table__, [{"brand_name": b} for b in brands])
+    models = df[["model", "brand"]].dropna(subset=["model"]).drop_duplicates("model")
+    insert_ignore(conn, Model.__table__, [
+        {"model_name": m, "brand_name": b if pd.notna(b) else None}
+        for m, b in zip(models["model"], models["brand"])
+    ])
+    bodies = df["bodytype"].dropna().unique()
+    insert_ignore(conn, BodyType.__table__, [{"body_type_name": b} for b in bodies])
+
+
+def to_records(df: pd.DataFrame) -> list:
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def add_price_ranges(records: list, model_available: bool):
+    # Без модели, а также для строк без цены или с пропусками в признаках
+    # модели остаётся price_range из файла (если колонки нет — NULL)
+    for record in records:
+        record["price_model_version"] = None
+    if not model_available:
+        return
+    priced = [r for r in records if r["price"] is not None and price_model.has_features(r)]
+    if not priced:
+        return
+    predicted = price_model.predict_with_version(priced)
+    actual = price_model.prices_to_ranges([r["price"] for r in priced])
+    for record, (value, version), band in zip(priced, predicted, actual):
+        record["price_range"] = value - int(band)
+        record["price_model_version"] = version
+
+
+def load_checkpoint(conn, source: str) -> int:
+    row = conn.execute(select(ImportCheckpoint.rows_done).where(ImportCheckpoint.source == source)).first()
+    return row.rows_done if row else 0
+
+
+def save_checkpoint(conn, source: str, rows_done: int):
+    updated = conn.execute(
+        ImportCheckpoint.__table__.update()
+        .where(ImportCheckpoint.source == source)
+        .values(rows_done=rows_done, updated_at=datetime.now())
+    )
+    if not updated.rowcount:
+        conn.execute(insert(ImportCheckpoint), {
+            "source": source, "rows_done": rows_done, "updated_at": datetime.now(),
+        })
+
+
+def import_csv(path: str, chunk_size: int = 5000, limit: int = None, restart: bool = False):
+    source = os.path.abspath(path)
+    with engine.begin() as conn:
+        if restart:
+            save_checkpoint(conn, source, 0)
+        start_row = load_checkpoint(conn, source)
+    if start_row:
+        print(f"Продолжаем с строки {start_row}")
+
+    # счётчики по машинам, которые были в базе до импорта: иначе фасеты и
+    # статистика дополнятся только импортированными
+    facets.ensure_facets(engine)
+    market_stats.ensure_market_stats(engine)
+
+    model_available = price_model.get_model() is not None
+    if not model_available:
+        print("Модель не загружена — price_range берётся из файла")
+
+    started = time.perf_counter()
+    rows_done, inserted, skipped = start_row, 0, 0
+    reader = pd.read_csv(
+        path, chunksize=chunk_size, skiprows=range(1, start_row + 1), dtype={"vin": str, "state_number": str}
+    )
+    for chunk in reader:
+        if limit is not None and rows_done - start_row >= limit:
+            break
+        if limit is not None:
+            chunk = chunk.head(limit - (rows_done - start_row))
+
+        with engine.begin() as conn:
+            df = drop_duplicates(conn, prepare_chunk(chunk))
+            upsert_references(conn, df)
+            records = to_records(df)
+            add_price_ranges(records, model_available)
+            if records:
+                conn.execute(insert(Car), records)
+                facets.add_cars(conn, records)
+                market_stats.mark_changed(conn, records)
+            rows_done += len(chunk)
+            save_checkpoint(conn, source, rows_done)
+
+        inserted += len(records)
+        skipped += len(chunk) - len(records)
+        elapsed = time.perf_counter() - started
+        print(f"  строк {rows_done}: вставлено {inserted}, пропущено {skipped}, "
+              f"{(rows_done - start_row) / elapsed:.0f} строк/с")
+
+    return inserted, skipped, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csv', nargs='?', default='result3.csv')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--limit', type=int, help='обработать не больше N строк')
+    parser.add_argument('--restart', action='store_true', help='сбросить checkpoint и читать файл с начала')
+    args = parser.parse_args()
+
+    ensure_schema(engine)
+    inserted, skipped, seconds = import_csv(args.csv, args.chunk_size, args.limit, args.restart)
+    rate = (inserted + skipped) / seconds if seconds else 0
+    print(f"✅ {args.csv}: вставлено {inserted}, пропущено дубликатов {skipped} "
+          f"за {seconds:.1f} с ({rate:.0f} строк/с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,34 @@ from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from datetime import timedelta
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 import price_model
+from price_batcher import make_batcher
 import pandas as pd
 import os
 import shutil
 import random
 from typing import Optional, List
+from functools import partial
 
 # Импорты ваших моделей
-from models import User, Session as DBSession, Base, engine, Car, Favorite, Brand, Model, BodyType
+from models import User, Session as DBSession, Base, engine, ensure_schema, Car, Favorite, Photo
+from serializers import format_car_dict
+from car_search import search_cars
+from car_fts import ensure_fts, text_condition, text_search
+from reference_cache import ensure_reference_trigger, reference_cache
+import facets
+import market_stats
 from auth import (
-    authenticate_user, create_access_token, get_current_user, 
+    authenticate_user, create_access_token, 
     get_password_hash, get_user_by_login, SECRET_KEY, ALGORITHM,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    ACCESS_TOKEN_EXPIRE_MINUTES, UserSnapshot, resolve_user, user_cache
 )
 
 # 1. Создаем таблицы
@@ -31,8 +40,30 @@ app = FastAPI(title="Sellcar API")
 
 @app.on_event("startup")
 def startup_event():
-    # Эта команда создаст таблицы, если их еще нет
-    Base.metadata.create_all(bind=engine)
+    # Создаёт недостающие таблицы и nullable-колонки
+    ensure_schema(engine)
+    # полнотекстовый индекс объявлений; при первом создании заполняется
+    ensure_fts(engine)
+    # счётчики фасетов; пока они не собраны по всей cars — полный пересчёт
+    facets.ensure_facets(engine)
+    # недостающие марки / модели / кузова вставляет триггер в INSERT машины;
+    # кэш известных значений нужен, только если триггер создать не удалось
+    reference_cache.trigger = ensure_reference_trigger(engine)
+    if not reference_cache.trigger:
+        db = DBSession()
+        try:
+            reference_cache.warm(db)
+        finally:
+            db.close()
+    # Модель цены грузим в фоне, не задерживая старт; дальше следим
+    # за файлом модели (PRICE_MODEL_WATCH_SECONDS, 0 — не следить)
+    price_model.warm_up()
+    # рыночная статистика: заполнение и пересчёт изменившихся моделей
+    # в фоне (MARKET_STATS_REFRESH_SECONDS, 0 — только по расписанию)
+    market_stats.start_refresher()
+    # процессы пула рекомендаций (RECOMMENDER_WORKERS > 0) запускаются
+    # и строят индекс до первого запроса
+    scoring_pool.warm_up()
 
 # 3. Настройка CORS
 app.add_middleware(
@@ -110,6 +141,16 @@ def get_db():
     finally:
         db.close()
 
+# Пользователь из куки access_token: один decode и поиск на запрос,
+# повторные запросы с тем же токеном — из auth.user_cache
+def optional_user(request: Request, db: Session = Depends(get_db)) -> Optional[UserSnapshot]:
+    return resolve_user(request.cookies.get("access_token"), db)
+
+def current_user(user: Optional[UserSnapshot] = Depends(optional_user)) -> UserSnapshot:
+    if user is None:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+    return user
+
 # --- Auth Endpoints ---
 
 @app.post("/api/register", response_model=Token)
@@ -153,36 +194,36 @@ def api_login(user_data: UserLogin, db: Session = Depends(get_db)):
     return response
 
 @app.post("/api/logout")
-def logout():
+def logout(request: Request):
+    token = request.cookies.get("access_token")
+    if token:
+        user_cache.invalidate_token(token)
     response = JSONResponse(content={"message": "ok"})
     response.delete_cookie(key="access_token")
     return response
 
+@app.get("/api/auth/stats")
+def get_auth_stats():
+    return {"cache": user_cache.stats()}
+
 @app.get("/api/user")
-def get_user_info(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: return {"authenticated": False}
-    try:
-        user = get_current_user(token, db)
-        if not user: return {"authenticated": False}
-        return {
-            "authenticated": True, "user_id": user.user_id,
-            "first_name": user.first_name, "last_name": user.last_name,
-            "login": user.login, "phone": user.phone, "avatar_url": user.avatar_url
-        }
-    except:
-        return {"authenticated": False}
+def get_user_info(user: Optional[UserSnapshot] = Depends(optional_user)):
+    if not user: return {"authenticated": False}
+    return {
+        "authenticated": True, "user_id": user.user_id,
+        "first_name": user.first_name, "last_name": user.last_name,
+        "login": user.login, "phone": user.phone, "avatar_url": user.avatar_url
+    }
     
 ph = PasswordHasher()
 
 @app.put("/api/user/profile")
-def update_profile(user_data: UserUpdate, request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: 
+def update_profile(user_data: UserUpdate, current: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
+    # для записи нужен ORM-объект: поиск по первичному ключу
+    user = db.get(User, current.user_id)
+    if user is None:
         raise HTTPException(status_code=401, detail="Не авторизован")
     
-    user = get_current_user(token, db)
-    
     # 1. Проверка уникальности телефона (чтобы не было UNIQUE constraint failed)
     if user.phone != user_data.phone:
         existing_phone = db.query(User).filter(User.phone == user_data.phone).first()
@@ -214,14 +255,14 @@ def update_profile(user_data: UserUpdate, request: Request, db: Session = Depend
         db.rollback()
         print(f"Database error: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при сохранении в базу данных")
-        
+
+    user_cache.invalidate_user(user.user_id)
     return {"message": "ok"}
 
 @app.post("/api/user/avatar")
-async def update_avatar(file: UploadFile = File(...), request: Request = None, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+async def update_avatar(file: UploadFile = File(...), current: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
+    user = db.get(User, current.user_id)
+    if user is None: raise HTTPException(401)
     ext = file.filename.split('.')[-1]
     fname = f"avatar_{user.user_id}.{ext}"
     path = f"static/avatars/{fname}"
@@ -229,75 +270,71 @@ async def update_avatar(file: UploadFile = File(...), request: Request = None, d
         shutil.copyfileobj(file.file, buffer)
     user.avatar_url = f"/static/avatars/{fname}"
     db.commit()
+    user_cache.invalidate_user(user.user_id)
     return {"avatar_url": user.avatar_url}
 
 # --- Cars & Logic ---
-from car_recommendation import get_car_recommendations  # твоя функция
+from car_recommendation import (  # твоя функция
+    get_car_recommendations, inventory_index, profile_cache,
+    invalidate_precomputed, serving_stats
+)
+from recommendation_pool import make_pool
+
+# RECOMMENDER_WORKERS > 0 — скоринг в отдельных процессах
+scoring_pool = make_pool(inventory_index)
+
+@app.on_event("shutdown")
+def shutdown_scoring_pool():
+    scoring_pool.shutdown()
+    price_model.registry.stop_watcher()
+    market_stats.stop_refresher()
+
 @app.get("/api/cars/recommended")
 def get_recommended_cars(
-    request: Request,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    bodytype: Optional[str] = None,
+    user: UserSnapshot = Depends(current_user),
 ):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401)
-
-    user = get_current_user(token, db)
-
-    # 1. Получаем car_id по рекомендациям
-    recommended_ids = get_car_recommendations(
+    # Движок сам исключает свои и уже лайкнутые машины
+    # и возвращает готовые карточки — второй запрос в БД не нужен
+    return get_car_recommendations(
         user_id=user.user_id,
-        top_n=limit
-    )
-
-    if not recommended_ids:
-        return []
-
-    # 2. Загружаем машины из БД
-    # ДОБАВЛЯЕМ ФИЛЬТР: Car.user_id != user.user_id
-    cars = (
-        db.query(Car)
-        .filter(Car.car_id.in_(recommended_ids))
-        .filter(Car.seller_id != user.user_id)  # <-- Вот эта магическая строка
-        .all()
+        top_n=limit,
+        bodytype=bodytype,
+        scorer=scoring_pool.score if scoring_pool.enabled else None
     )
 
-    # 3. Сохраняем порядок рекомендаций
-    cars_map = {c.car_id: c for c in cars}
-    ordered_cars = [cars_map[i] for i in recommended_ids if i in cars_map]
+@app.get("/api/recommender/stats")
+def get_recommender_stats():
+    return {
+        "index": inventory_index.stats(),
+        "profile_cache": profile_cache.stats(),
+        "served": dict(serving_stats),
+        "pool": scoring_pool.stats() if scoring_pool.enabled else None,
+    }
 
-    # 4. Форматируем
-    result = []
-    for car in ordered_cars:
-        # Здесь должна быть ваша логика получения фото, если она есть
-        result.append(format_car_dict(car, []))
+# PRICE_BATCH_SIZE / PRICE_BATCH_DELAY_MS — настройки микробатчинга;
+# кэш предсказаний проверяется до постановки в очередь
+price_batcher = make_batcher(
+    partial(price_model.predict_with_version, lookup=False),
+    lookup=price_model.cached_price_range,
+)
 
-    return result
+@app.get("/api/price-model/stats")
+def get_price_model_stats():
+    return {
+        "model": price_model.registry.stats(),
+        "bands": price_model.price_bands.stats(),
+        "batcher": price_batcher.stats(),
+        "cache": price_model.prediction_cache.stats(),
+    }
 
 @app.post("/api/cars")
-def create_car(car_data: CarCreate, request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+def create_car(car_data: CarCreate, user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
 
-    # Бренд
-    brand = db.query(Brand).filter(Brand.brand_name == car_data.brand).first()
-    if not brand:
-        db.add(Brand(brand_name=car_data.brand))
-        db.commit()
-    
-    # Модель
-    model = db.query(Model).filter(Model.model_name == car_data.model).first()
-    if not model:
-        db.add(Model(model_name=car_data.model, brand_name=car_data.brand))
-        db.commit()
-
-    # Кузов
-    body = db.query(BodyType).filter(BodyType.body_type_name == car_data.bodytype).first()
-    if not body:
-        db.add(BodyType(body_type_name=car_data.bodytype))
-        db.commit()
+    # Бренд, модель, кузов дополняет триггер на cars в INSERT машины;
+    # без триггера — запрос только за тем, чего нет в кэше, в той же транзакции
+    new_references = reference_cache.ensure(db, car_data.brand, car_data.model, car_data.bodytype)
 
     try:
         disp = float(str(car_data.engine_displacement).split('L')[0].strip())
@@ -320,7 +357,8 @@ def create_car(car_data: CarCreate, request: Request, db: Session = Depends(get_
         "owners": car_data.owners
     }
 
-    predicted_range = price_model.predict_price_range(car_dict)
+    # параллельные создания объявлений предсказываются одной пачкой
+    predicted_range, model_version = price_batcher.predict(car_dict)
     actual_range = price_model.price_to_range(car_data.price)
     price_range_diff = predicted_range - actual_range
 
@@ -342,17 +380,25 @@ def create_car(car_data: CarCreate, request: Request, db: Session = Depends(get_
         wheel=car_data.wheel,
         price=car_data.price,
         price_range=price_range_diff,         
+        price_model_version=model_version,
         vin=car_data.vin,
         state_number=car_data.state_number
     )
     
     try:
         db.add(db_car)
+        facets.add_cars(db.connection(), [db_car])
+        market_stats.mark_changed(db.connection(), [db_car])
+        invalidate_precomputed(db, user.user_id)
         db.commit()
         db.refresh(db_car)
     except Exception as e:
         db.rollback()
         raise HTTPException(500, detail=str(e))
+
+    reference_cache.remember(new_references)
+    inventory_index.add_car(db_car)
+    profile_cache.add_car(user.user_id, db_car.car_id, 'own')
     
     return {"message": "Created", "car_id": db_car.car_id}
 
@@ -366,23 +412,118 @@ def create_car(car_data: CarCreate, request: Request, db: Session = Depends(get_
 #         res.append(format_car_dict(c, photos))
 #     return res
 
+# Объявлен до /api/cars/{car_id}, иначе "search" уйдёт в car_id.
+# q — полнотекстовый запрос: без sort выдача по релевантности,
+# с sort — совпадение по тексту работает как ещё один фильтр
+@app.get("/api/cars/search")
+def search_cars_endpoint(
+    q: Optional[str] = None,
+    brand: Optional[str] = None,
+    model: Optional[str] = None,
+    bodytype: Optional[str] = None,
+    fuel_type: Optional[str] = None,
+    vehicle_transmission: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    mileage_min: Optional[int] = None,
+    mileage_max: Optional[int] = None,
+    sort: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    filters = {
+        "brand": brand, "model": model, "bodytype": bodytype, "fuel_type": fuel_type,
+        "vehicle_transmission": vehicle_transmission,
+        "price_min": price_min, "price_max": price_max,
+        "year_min": year_min, "year_max": year_max,
+        "mileage_min": mileage_min, "mileage_max": mileage_max,
+    }
+    try:
+        if q is not None and sort in (None, "relevance"):
+            return text_search(db, q, filters, limit, cursor)
+        conditions = [text_condition(q, db.get_bind().dialect.name)] if q is not None else []
+        return search_cars(db, filters, sort or "newest", limit, cursor, conditions)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+@app.get("/api/cars/facets")
+def car_facets_endpoint(
+    q: Optional[str] = None,
+    brand: Optional[str] = None,
+    model: Optional[str] = None,
+    bodytype: Optional[str] = None,
+    fuel_type: Optional[str] = None,
+    vehicle_transmission: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    mileage_min: Optional[int] = None,
+    mileage_max: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # Счётчики по марке, кузову, топливу, коробке и диапазону цены
+    # при тех же фильтрах, что у /api/cars/search
+    filters = {
+        "brand": brand, "model": model, "bodytype": bodytype, "fuel_type": fuel_type,
+        "vehicle_transmission": vehicle_transmission,
+        "price_min": price_min, "price_max": price_max,
+        "year_min": year_min, "year_max": year_max,
+        "mileage_min": mileage_min, "mileage_max": mileage_max,
+    }
+    try:
+        conditions = [text_condition(q, db.get_bind().dialect.name)] if q is not None else []
+        return facets.facet_counts(db, filters, conditions)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+@app.get("/api/market/stats")
+def market_stats_endpoint(brand: str, model: str, bodytype: Optional[str] = None, db: Session = Depends(get_db)):
+    # Распределение цен по модели для страницы продаж
+    stats = market_stats.lookup(db, brand, model, bodytype)
+    if stats is None:
+        raise HTTPException(404, "Not enough comparables")
+    return stats
+
+# Фото грузятся одним selectin-запросом на всю выдачу, а не по запросу
+# на машину; из photos нужен только photo_url
+photos_option = selectinload(Car.photos).load_only(Photo.photo_url)
+
+def photo_list(car):
+    return [{"photo_url": p.photo_url} for p in car.photos]
+
 @app.get("/api/cars/{car_id}")
 def get_car_details(car_id: int, db: Session = Depends(get_db)):
-    car = db.query(Car).filter(Car.car_id == car_id).first()
-    if not car: 
+    # Машина, продавец (JOIN) и sales_count (коррелированный подзапрос)
+    # одним запросом, фото — вторым
+    seller_cars = aliased(Car)
+    sales_count = (
+        select(func.count(seller_cars.car_id))
+        .where(seller_cars.seller_id == Car.seller_id)
+        .scalar_subquery()
+    )
+    row = (
+        db.query(Car, sales_count)
+        .options(
+            joinedload(Car.seller).load_only(User.first_name, User.last_name, User.phone),
+            photos_option,
+        )
+        .filter(Car.car_id == car_id)
+        .first()
+    )
+    if not row: 
         raise HTTPException(404, "Not found")
+    car, sales_count = row
     
-    photos = [{"photo_url": p.photo_url} for p in car.photos] if car.photos else []
-    data = format_car_dict(car, photos)
+    data = format_car_dict(car, photo_list(car))
     
     # Добавляем ID владельца в корень ответа, чтобы JS его сразу увидел
     data['user_id'] = car.seller_id 
 
     if car.seller:
-        sales_count = db.query(func.count(Car.car_id)).filter(
-            Car.seller_id == car.seller.user_id
-        ).scalar()
-        
         data['seller'] = {
             "user_id": car.seller.user_id, # Также добавим сюда для надежности
             "first_name": car.seller.first_name,
@@ -392,95 +533,72 @@ def get_car_details(car_id: int, db: Session = Depends(get_db)):
         }
     else:
         data['seller'] = None
+
+    # цены похожих машин: одна строка market_stats по ключу
+    data['market'] = market_stats.comparables(db, car)
         
     return data
 
 @app.get("/api/user/cars")
-def get_user_cars(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+def get_user_cars(user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
     
-    cars = db.query(Car).filter(Car.seller_id == user.user_id).all()
-    res = []
-    for c in cars:
-        photos = [{"photo_url": p.photo_url} for p in c.photos] if c.photos else []
-        res.append(format_car_dict(c, photos))
-    return res
+    cars = db.query(Car).options(photos_option).filter(Car.seller_id == user.user_id).all()
+    return [format_car_dict(c, photo_list(c)) for c in cars]
 
 @app.get("/api/user/favorites")
-def get_favorites(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+def get_favorites(user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
     
-    favs = db.query(Favorite).filter(Favorite.user_id == user.user_id).all()
-    res = []
-    for f in favs:
-        if f.car_ref:
-            photos = [{"photo_url": p.photo_url} for p in f.car_ref.photos] if f.car_ref.photos else []
-            res.append(format_car_dict(f.car_ref, photos))
-    return res
+    # машины избранного через JOIN, в порядке добавления
+    cars = (
+        db.query(Car)
+        .join(Favorite, Favorite.car_id == Car.car_id)
+        .filter(Favorite.user_id == user.user_id)
+        .options(photos_option)
+        .order_by(Favorite.favorites_id)
+        .all()
+    )
+    return [format_car_dict(c, photo_list(c)) for c in cars]
 
 @app.post("/api/favorites/{car_id}")
-def add_favorite(car_id: int, request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
-    
-    if db.query(Favorite).filter(Favorite.user_id == user.user_id, Favorite.car_id == car_id).first():
+def add_favorite(car_id: int, user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
+    if db.get(Car, car_id) is None:
+        raise HTTPException(404, "Not found")
+
+    # дубликат отсекает уникальный индекс uq_favorites_user_car
+    try:
+        db.add(Favorite(user_id=user.user_id, car_id=car_id))
+        invalidate_precomputed(db, user.user_id)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
         return {"status": "exists"}
-    
-    db.add(Favorite(user_id=user.user_id, car_id=car_id))
-    db.commit()
+    profile_cache.add_car(user.user_id, car_id, 'liked')
     return {"status": "added"}
 
 @app.delete("/api/favorites/{car_id}")
-def remove_favorite(car_id: int, request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+def remove_favorite(car_id: int, user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
     db.query(Favorite).filter(Favorite.user_id == user.user_id, Favorite.car_id == car_id).delete()
+    invalidate_precomputed(db, user.user_id)
     db.commit()
+    profile_cache.remove_car(user.user_id, car_id, 'liked')
     return {"status": "removed"}
 
 @app.delete("/api/cars/{car_id}")
-def delete_car(car_id: int, request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token: raise HTTPException(401)
-    user = get_current_user(token, db)
+def delete_car(car_id: int, user: UserSnapshot = Depends(current_user), db: Session = Depends(get_db)):
     car = db.query(Car).filter(Car.car_id == car_id, Car.seller_id == user.user_id).first()
     if not car: raise HTTPException(404)
+    likers = [r.user_id for r in db.query(Favorite.user_id).filter(Favorite.car_id == car_id)]
+    facets.remove_cars(db.connection(), [car])
+    market_stats.mark_changed(db.connection(), [car])
     db.delete(car)
+    invalidate_precomputed(db, user.user_id)
     db.commit()
+    # вектор машины нужен, чтобы вычесть её из профиля — до remove_car
+    profile_cache.remove_car(user.user_id, car_id, 'own')
+    profile_cache.invalidate(*likers)
+    inventory_index.remove_car(car_id)
     return {"message": "deleted"}
 
-def format_car_dict(c, photos):
-    return {
-        "car_id": c.car_id,
-        "brand": c.brand,
-        "model": c.model,
-        "price": float(c.price or 0),
-        "mileage": c.mileage,
-        "year": c.production_date,
-        "production_date": c.production_date,
-        "engine_displacement": float(c.engine_displacement or 0),
-        "engine_power": float(c.engine_power or 0),
-        "fuel_type": c.fuel_type,
-        "vehicle_transmission": c.vehicle_transmission,
-        "bodytype": c.bodytype,
-        "body_type": c.bodytype, 
-        "color": c.color,
-        "drive_type": c.drive_type,
-        "wheel": c.wheel,
-        "owners": c.owners,
-        "vin": c.vin,
-        "state_number": c.state_number,
-        "description": c.description,
-        "price_range": c.price_range,
-        "photos": photos
-    }
-
 # --- Pages Routing (ВАЖНО: Порядок имеет значение) ---
 
 # 1. Корневой маршрут (Главная)
@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.orm import Session
+
+from models import Car, MarketStat, engine as default_engine, is_built, mark_built
+
+# -----------------------------
+# Рыночная статистика цен по моделям
+# -----------------------------
+# Для каждой тройки (марка, модель, кузов) и для модели целиком
+# (bodytype = '*') в market_stats лежат: число машин, min / max / среднее,
+# квантили 10-25-50-75-90 и медианы по году выпуска и корзинам пробега.
+# Карточка машины и страница продаж читают одну строку по первичному
+# ключу — без сканирования объявлений на каждый запрос.
+#
+# Обновление:
+#   - create_car, delete_car и import_cars.py увеличивают changes у групп
+#     затронутых машин (в своей транзакции);
+#   - пересчёт берёт группы с changes > 0, перечитывает только их машины
+#     (индекс ix_cars_brand_model_price) и вычитает увиденное значение
+#     changes, если оно не меньше увиденного, — изменения, пришедшие во
+#     время пересчёта, не теряются, а пересёкшиеся пересчёты не уводят
+#     changes в минус;
+#   - API делает это в фоне раз в MARKET_STATS_REFRESH_SECONDS
+#     (0 — не делать), либо по расписанию:
+#       python market_stats.py            # только изменившиеся группы
+#                                         # (в первый раз — все)
+#       python market_stats.py --full     # все группы заново
+
+KEY = ["brand", "model", "bodytype"]
+ALL_BODIES = "*"
+QUANTILES = {"p10": 0.1, "p25": 0.25, "median": 0.5, "p75": 0.75, "p90": 0.9}
+STAT_COLUMNS = ["count", "price_min", *QUANTILES, "price_max", "mean", "by_year", "by_mileage", "updated_at"]
+
+MILEAGE_BUCKET = int(os.getenv("MARKET_MILEAGE_BUCKET", "50000"))
+MIN_COMPARABLES = int(os.getenv("MARKET_MIN_COMPARABLES", "5"))
+REFRESH_SECONDS = float(os.getenv("MARKET_STATS_REFRESH_SECONDS", "300"))
+# при большем числе изменившихся моделей дешевле прочитать cars целиком
+FULL_SCAN_PAIRS = 500
+BUILD_NAME = "market_stats"
+
+
+def group_keys(car) -> list:
+    # car — словарь (записи импорта) или объект Car
+    get = car.get if isinstance(car, dict) else lambda name: getattr(car, name, None)
+    brand, model, body = (get(name) or "" for name in KEY)
+    return [(brand, model, body), (brand, model, ALL_BODIES)]
+
+
+def upsert(conn, rows: list, columns: list):
+    # Вставка или обновление columns; changes при конфликте складывается
+    table = MarketStat.__table__
+    if not rows:
+        return
+    if conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        new = stmt.excluded
+        set_ = {c: new[c] for c in columns}
+        set_["changes"] = table.c.changes + new.changes
+        stmt = stmt.on_conflict_do_update(index_elements=KEY, set_=set_)
+    else:
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        new = stmt.inserted
+        set_ = {c: new[c] for c in columns}
+        set_["changes"] = table.c.changes + new.changes
+        stmt = stmt.on_duplicate_key_update(**set_)
+    conn.execute(stmt, rows)
+
+
+def mark_changed(conn, cars):
+    counts = defaultdict(int)
+    for car in cars:
+        for key in group_keys(car):
+            counts[key] += 1
+    upsert(conn, [
+        {**dict(zip(KEY, key)), "count": 0, "changes": n} for key, n in counts.items()
+    ], [])
+
+
+# -----------------------------
+# Расчёт
+# -----------------------------
+
+def key_condition(column, value: str):
+    return column.is_(None) if value == "" else column == value
+
+
+def load_prices(conn, pairs=None) -> pd.DataFrame:
+    # Машины с ценой; pairs — {(марка, модель)}, None — весь каталог
+    columns = [Car.brand, Car.model, Car.bodytype, Car.price, Car.production_date, Car.mileage]
+    query = select(*columns).where(Car.price.isnot(None))
+    if pairs is None or len(pairs) > FULL_SCAN_PAIRS:
+        rows = conn.execute(query).all()
+    else:
+        rows = []
+        for brand, model in pairs:
+            rows += conn.execute(
+                query.where(key_condition(Car.brand, brand), key_condition(Car.model, model))
+            ).all()
+
+    df = pd.DataFrame(rows, columns=KEY + ["price", "production_date", "mileage"])
+    for column in KEY:
+        df[column] = df[column].fillna("")
+    for column in ["price", "production_date", "mileage"]:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype(float)
+    if pairs is not None and len(pairs) > FULL_SCAN_PAIRS:
+        df = df[pd.Series(list(zip(df["brand"], df["model"])), index=df.index).isin(pairs)]
+    return df
+
+
+def trend(df: pd.DataFrame, column: str) -> dict:
+    # {группа: {значение column: {count, median}}}
+    grouped = df.dropna(subset=[column]).groupby(KEY + [column])["price"].agg(["count", "median"])
+    result = defaultdict(dict)
+    for (brand, model, body, value), (count, median) in zip(grouped.index, grouped.values):
+        result[(brand, model, body)][str(int(value))] = {"count": int(count), "median": round(median)}
+    return result
+
+
+def compute(df: pd.DataFrame) -> dict:
+    # {(марка, модель, кузов): строка market_stats}
+    if df.empty:
+        return {}
+    both = pd.concat([df, df.assign(bodytype=ALL_BODIES)], ignore_index=True)
+    both["mileage_bucket"] = (both["mileage"] // MILEAGE_BUCKET) * MILEAGE_BUCKET
+
+    prices = both.groupby(KEY, sort=False)["price"]
+    summary = prices.agg(["count", "min", "max", "mean"])
+    quantiles = prices.quantile(list(QUANTILES.values())).unstack()
+    quantiles.columns = list(QUANTILES)
+    summary = summary.join(quantiles)
+    by_year = trend(both, "production_date")
+    by_mileage = trend(both, "mileage_bucket")
+
+    now = datetime.now()
+    stats = {}
+    for key, row in summary.iterrows():
+        stats[key] = {
+            **dict(zip(KEY, key)),
+            "count": int(row["count"]),
+            "price_min": float(row["min"]),
+            "price_max": float(row["max"]),
+            "mean": float(row["mean"]),
+            **{name: float(row[name]) for name in QUANTILES},
+            "by_year": json.dumps(by_year.get(key, {})),
+            "by_mileage": json.dumps(by_mileage.get(key, {})),
+            "updated_at": now,
+        }
+    return stats
+
+
+def pending(conn, full: bool = False) -> dict:
+    # {группа: changes} — группы к пересчёту (full — все)
+    query = select(MarketStat.brand, MarketStat.model, MarketStat.bodytype, MarketStat.changes)
+    if not full:
+        query = query.where(MarketStat.changes > 0)
+    return {(r.brand, r.model, r.bodytype): r.changes for r in conn.execute(query)}
+
+
+def save(conn, seen: dict, stats: dict):
+    upsert(conn, [{**row, "changes": 0} for row in stats.values()], STAT_COLUMNS)
+    # changes - увиденное, только если отметок не меньше: отметки, сделанные
+    # после чтения, остаются, а пересчёт, пересёкшийся с другим, уже
+    # вычтенное повторно не вычтет и не уведёт changes в минус
+    consumed = [{**dict(zip(["b_" + c for c in KEY], key)), "seen": n} for key, n in seen.items() if n > 0]
+    if consumed:
+        conn.execute(
+            update(MarketStat)
+            .where(
+                *[getattr(MarketStat, c) == bindparam("b_" + c) for c in KEY],
+                MarketStat.changes >= bindparam("seen"),
+            )
+            .values(changes=MarketStat.changes - bindparam("seen")),
+            consumed,
+        )
+    for key in set(seen) - set(stats):
+        # машин в группе не осталось
+        conn.execute(delete(MarketStat).where(
+            *[getattr(MarketStat, c) == v for c, v in zip(KEY, key)],
+            MarketStat.changes <= 0,
+        ))
+
+
+def refresh(bind=default_engine, full: bool = False) -> int:
+    # Пересчёт изменившихся групп (full — всех); возвращает число групп
+    with bind.connect() as conn:
+        seen = pending(conn, full)
+        if not seen and not full:
+            return 0
+        pairs = None if full else {(brand, model) for brand, model, _ in seen}
+        stats = compute(load_prices(conn, pairs))
+
+    with bind.begin() as conn:
+        save(conn, seen, stats)
+        if full:
+            mark_built(conn, BUILD_NAME)
+    return len(set(seen) | set(stats))
+
+
+def ensure_market_stats(bind=default_engine) -> bool:
+    # Полный пересчёт, пока статистика ни разу не считалась по всей cars:
+    # mark_changed импорта оставляет строки-заготовки только для групп
+    # импортированных машин, и группы старых машин иначе не посчитаются
+    with bind.begin() as conn:
+        # отрицательные changes оставляли пересёкшиеся пересчёты старых версий
+        conn.execute(update(MarketStat).where(MarketStat.changes < 0).values(changes=0))
+        if is_built(conn, BUILD_NAME):
+            return False
+    started = time.perf_counter()
+    groups = refresh(bind, full=True)
+    if groups:
+        print(f"Рыночная статистика посчитана: {groups} групп за {time.perf_counter() - started:.1f} с")
+    return True
+
+
+_stop = threading.Event()
+
+
+def start_refresher(interval: float = None, bind=default_engine):
+    # Фоновый пересчёт в API: первичное заполнение, затем изменившиеся группы
+    if interval is None:
+        interval = REFRESH_SECONDS
+    if interval <= 0:
+        return None
+
+    def run():
+        try:
+            ensure_market_stats(bind)
+        except Exception as e:
+            print(f"Ошибка расчёта рыночной статистики: {e}")
+        while not _stop.wait(interval):
+            try:
+                refresh(bind)
+            except Exception as e:
+                print(f"Ошибка пересчёта рыночной статистики: {e}")
+
+    _stop.clear()
+    thread = threading.Thread(target=run, name="market-stats-refresher", daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_refresher():
+    _stop.set()
+
+
+# -----------------------------
+# Чтение
+# -----------------------------
+
+def format_stat(row: MarketStat) -> dict:
+    return {
+        "brand": row.brand or None,
+        "model": row.model or None,
+        "bodytype": None if row.bodytype in ("", ALL_BODIES) else row.bodytype,
+        "scope": "model" if row.bodytype == ALL_BODIES else "bodytype",
+        "count": row.count,
+        "price_min": row.price_min,
+        **{name: getattr(row, name) for name in QUANTILES},
+        "price_max": row.price_max,
+        "mean": round(row.mean) if row.mean is not None else None,
+        "by_year": json.loads(row.by_year or "{}"),
+        "by_mileage": json.loads(row.by_mileage or "{}"),
+        "mileage_bucket": MILEAGE_BUCKET,
+        "updated_at": row.updated_at,
+        "pending_changes": row.changes,
+    }
+
+
+def lookup(db: Session, brand: str, model: str, bodytype: str = None):
+    # Статистика кузова, если сравнимых машин достаточно, иначе всей модели.
+    # Две строки по первичному ключу
+    body = bodytype or ""
+    rows = {
+        row.bodytype: row for row in db.execute(
+            select(MarketStat).where(
+                MarketStat.brand == (brand or ""),
+                MarketStat.model == (model or ""),
+                MarketStat.bodytype.in_([body, ALL_BODIES]),
+            )
+        ).scalars()
+    }
+    for key in ([body] if bodytype != ALL_BODIES else []) + [ALL_BODIES]:
+        row = rows.get(key)
+        if row is not None and row.count >= MIN_COMPARABLES:
+            return format_stat(row)
+    return None
+
+
+def comparables(db: Session, car: Car):
+    # Статистика для карточки машины плюс положение её цены на рынке
+    stats = lookup(db, car.brand, car.model, car.bodytype)
+    if stats is None:
+        return None
+    if car.price and stats["median"]:
+        stats["price_vs_median"] = round(float(car.price) / stats["median"] - 1, 4)
+    if car.production_date is not None:
+        stats["same_year"] = stats["by_year"].get(str(car.production_date))
+    if car.mileage is not None:
+        stats["same_mileage"] = stats["by_mileage"].get(str(car.mileage // MILEAGE_BUCKET * MILEAGE_BUCKET))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', action='store_true', help='пересчитать все группы, а не только изменившиеся')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with default_engine.connect() as conn:
+        built = is_built(conn, BUILD_NAME)
+    groups = refresh(full=args.full or not built)
+    print(f"✅ Рыночная статистика: пересчитано {groups} групп за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
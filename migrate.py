@@ -0,0 +1,115 @@
+import argparse
+
+from sqlalchemy import DECIMAL, inspect, text
+
+import models
+from models import Car, ensure_schema, make_engine
+
+# -----------------------------
+# Обновление схемы существующей базы
+# -----------------------------
+# Запуск:
+#   python migrate.py                      # база из DATABASE_URL / DB_PATH
+#   python migrate.py --db old_cars.db     # другой файл SQLite
+#
+# Шаги: план горячих запросов до миграции, удаление дубликатов
+# избранного (иначе не создать uq_favorites_user_car), недостающие
+# колонки и индексы (ensure_schema), точность DECIMAL-колонок в MariaDB
+# (голый DECIMAL там — DECIMAL(10,0): 2.5 л хранились как 3), ANALYZE
+# и план после. Уже округлённые значения миграция не восстанавливает.
+
+# Горячие запросы main.py / car_recommendation.py
+HOT_QUERIES = {
+    "машины продавца (user/cars, профиль рекомендаций)":
+        "SELECT car_id FROM cars WHERE seller_id = :id",
+    "sales_count":
+        "SELECT count(car_id) FROM cars WHERE seller_id = :id",
+    "избранное пользователя":
+        "SELECT car_id FROM favorites WHERE user_id = :id",
+    "проверка лайка / удаление из избранного":
+        "SELECT favorites_id FROM favorites WHERE user_id = :id AND car_id = :id",
+    "лайкнувшие машину (delete_car)":
+        "SELECT user_id FROM favorites WHERE car_id = :id",
+    "фото машины":
+        "SELECT photo_url FROM photos WHERE car_id = :id",
+}
+
+
+def explain(conn, sql: str) -> list:
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), {"id": 1}).all()
+        return [row[-1] for row in rows]
+    rows = conn.execute(text("EXPLAIN " + sql), {"id": 1}).mappings().all()
+    return [f"{row.get('table')}: type={row.get('type')} key={row.get('key')}" for row in rows]
+
+
+def query_plans(engine) -> dict:
+    with engine.connect() as conn:
+        return {name: explain(conn, sql) for name, sql in HOT_QUERIES.items()}
+
+
+def dedupe_favorites(engine) -> int:
+    # Оставляем самую раннюю запись каждой пары (user_id, car_id)
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            "DELETE FROM favorites WHERE favorites_id NOT IN ("
+            " SELECT keep_id FROM (SELECT MIN(favorites_id) AS keep_id"
+            " FROM favorites GROUP BY user_id, car_id) AS keep)"
+        ))
+        return result.rowcount
+
+
+def widen_decimals(engine) -> list:
+    # SQLite хранит числа как есть; в MariaDB приводим точность к models.py
+    if engine.dialect.name == "sqlite":
+        return []
+    existing = {c["name"]: c["type"] for c in inspect(engine).get_columns(Car.__tablename__)}
+    changed = []
+    with engine.begin() as conn:
+        for column in Car.__table__.columns:
+            if not isinstance(column.type, DECIMAL) or column.name not in existing:
+                continue
+            current = existing[column.name]
+            if (getattr(current, "precision", None), getattr(current, "scale", None)) == \
+                    (column.type.precision, column.type.scale):
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {Car.__tablename__} MODIFY COLUMN {column.name} {col_type} NULL")
+            changed.append(f"{column.name} {col_type}")
+    return changed
+
+
+def migrate(engine):
+    before = query_plans(engine)
+
+    removed = dedupe_favorites(engine)
+    print(f"Удалено дубликатов избранного: {removed}")
+
+    ensure_schema(engine)
+    for column in widen_decimals(engine):
+        print(f"Изменён тип колонки cars.{column}")
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+    after = query_plans(engine)
+    for name in HOT_QUERIES:
+        print(f"\n{name}")
+        for line in before[name]:
+            print(f"  до:    {line}")
+        for line in after[name]:
+            print(f"  после: {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', help='путь к файлу SQLite; по умолчанию DATABASE_URL / DB_PATH')
+    args = parser.parse_args()
+
+    engine = make_engine(f'sqlite:///{args.db}') if args.db else models.engine
+    migrate(engine)
+    print("\n✅ Миграция завершена")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,74 @@
 from sqlalchemy import (
-    Column, Integer, String, ForeignKey, Text, DECIMAL,
-    UniqueConstraint, TIMESTAMP, create_engine
+    Column, Integer, String, ForeignKey, Text, DECIMAL, Float,
+    UniqueConstraint, TIMESTAMP, Index, create_engine, event, insert, inspect
 )
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
 from datetime import datetime
 import os
 
-# Подключаемся к существующему файлу
-engine = create_engine('sqlite:///cars_database.db', echo=False)
+# -----------------------------
+# Подключение к БД
+# -----------------------------
+# DATABASE_URL — полный URL SQLAlchemy, например
+#   mysql+pymysql://root:qwerty123@db/cars
+# Без него — файл SQLite из DB_PATH (по умолчанию cars_database.db).
+#
+# SQLite: на каждое соединение ставятся PRAGMA — WAL (читатели не ждут
+# писателя), synchronous=NORMAL, mmap и кэш страниц, busy_timeout вместо
+# мгновенного "database is locked" при параллельных create_car/add_favorite.
+# MariaDB: пул DB_POOL_SIZE + DB_MAX_OVERFLOW, pre-ping и пересоздание
+# соединений старше DB_POOL_RECYCLE секунд (wait_timeout сервера).
+
+DB_PATH = os.getenv("DB_PATH", "cars_database.db")
+DATABASE_URL = os.getenv("DATABASE_URL") or f"sqlite:///{DB_PATH}"
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_MB", "256")) * 1024 * 1024,
+    "cache_size": -int(os.getenv("SQLITE_CACHE_MB", "64")) * 1024,   # минус — размер в КиБ
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+}
+
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def make_engine(url: str = DATABASE_URL, echo: bool = False):
+    if url.startswith("sqlite"):
+        engine = create_engine(url, echo=echo)
+        if ":memory:" not in url and url not in ("sqlite://", "sqlite:///"):
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+    return create_engine(
+        url,
+        echo=echo,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_pre_ping=True,
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    )
+
+
+engine = make_engine()
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
-session = Session()
 
 class User(Base):
     __tablename__ = 'users'
 
     user_id = Column(Integer, primary_key=True, autoincrement=True)
-    login = Column(String, unique=True, nullable=False)
-    password_hash = Column(String, nullable=False)
-    first_name = Column(String, nullable=False)
-    last_name = Column(String)
-    phone = Column(String, unique=True, nullable=False)
-    avatar_url = Column(String)
+    login = Column(String(255), unique=True, nullable=False)
+    password_hash = Column(String(255), nullable=False)
+    first_name = Column(String(255), nullable=False)
+    last_name = Column(String(255))
+    phone = Column(String(255), unique=True, nullable=False)
+    avatar_url = Column(String(255))
 
 
     cars = relationship("Car", back_populates="seller")
@@ -31,7 +78,7 @@ class User(Base):
 class Brand(Base):
     __tablename__ = 'brands'
 
-    brand_name = Column(String, primary_key=True)
+    brand_name = Column(String(255), primary_key=True)
 
     models = relationship("Model", back_populates="brand_ref")
     cars = relationship("Car", back_populates="brand_ref")
@@ -41,8 +88,8 @@ class Model(Base):
     __tablename__ = 'models'
 
 
-    model_name = Column(String, primary_key=True)
-    brand_name = Column(String, ForeignKey("brands.brand_name"))
+    model_name = Column(String(255), primary_key=True)
+    brand_name = Column(String(255), ForeignKey("brands.brand_name"))
 
     brand_ref = relationship("Brand", back_populates="models")
     cars = relationship("Car", back_populates="model_ref")
@@ -51,7 +98,7 @@ class Model(Base):
 class BodyType(Base):
     __tablename__ = 'body_type'
 
-    body_type_name = Column(String, primary_key=True)
+    body_type_name = Column(String(255), primary_key=True)
 
     cars = relationship("Car", back_populates="body_type_ref")
     photos = relationship("Photo", back_populates="body_type_ref")
@@ -59,31 +106,52 @@ class BodyType(Base):
 
 class Car(Base):
     __tablename__ = 'cars'
+    # car_search.py: фильтр по равенству + сортировка, диапазоны цены/года/пробега.
+    # car_id в индексе неявно (rowid / первичный ключ InnoDB) — второй ключ keyset
+    __table_args__ = (
+        Index('ix_cars_brand_price', 'brand', 'price'),
+        Index('ix_cars_brand_model_price', 'brand', 'model', 'price'),
+        Index('ix_cars_bodytype_price', 'bodytype', 'price'),
+        Index('ix_cars_price', 'price'),
+        Index('ix_cars_production_date', 'production_date'),
+        Index('ix_cars_mileage', 'mileage'),
+        # сортировка "newest" (car_id) под фильтром: в индексе (brand) строки
+        # марки уже идут по car_id, без сортировки всех совпадений
+        Index('ix_cars_brand', 'brand'),
+        Index('ix_cars_brand_model', 'brand', 'model'),
+        Index('ix_cars_bodytype', 'bodytype'),
+        # по году и пробегу под фильтром марки / кузова
+        Index('ix_cars_brand_production_date', 'brand', 'production_date'),
+        Index('ix_cars_brand_mileage', 'brand', 'mileage'),
+        Index('ix_cars_bodytype_production_date', 'bodytype', 'production_date'),
+        Index('ix_cars_bodytype_mileage', 'bodytype', 'mileage'),
+    )
 
     car_id = Column(Integer, primary_key=True, autoincrement=True)
     
 
-    seller_id = Column(Integer, ForeignKey("users.user_id"), nullable=True)
-    brand = Column(String, ForeignKey("brands.brand_name"), nullable=True) 
-    model = Column(String, ForeignKey("models.model_name"), nullable=True)
-    bodytype = Column(String, ForeignKey("body_type.body_type_name"), nullable=True) 
+    seller_id = Column(Integer, ForeignKey("users.user_id"), nullable=True, index=True)
+    brand = Column(String(255), ForeignKey("brands.brand_name"), nullable=True) 
+    model = Column(String(255), ForeignKey("models.model_name"), nullable=True)
+    bodytype = Column(String(255), ForeignKey("body_type.body_type_name"), nullable=True) 
 
     description = Column(Text, nullable=True)
-    color = Column(String, nullable=True)
-    engine_displacement = Column(DECIMAL, nullable=True) 
-    engine_power = Column(DECIMAL, nullable=True)        
-    fuel_type = Column(String, nullable=True)
+    color = Column(String(255), nullable=True)
+    engine_displacement = Column(DECIMAL(4, 1), nullable=True)   # литры
+    engine_power = Column(DECIMAL(8, 1), nullable=True)          # л.с.
+    fuel_type = Column(String(255), nullable=True)
     mileage = Column(Integer, nullable=True)
     production_date = Column(Integer, nullable=True)   
-    vehicle_transmission = Column(String, nullable=True)
+    vehicle_transmission = Column(String(255), nullable=True)
     owners = Column(Integer, nullable=True)
-    drive_type = Column(String, nullable=True)        
-    wheel = Column(String, nullable=True)               
-    price = Column(DECIMAL, nullable=True)
+    drive_type = Column(String(255), nullable=True)        
+    wheel = Column(String(255), nullable=True)               
+    price = Column(DECIMAL(14, 2), nullable=True)
     
-    vin = Column(String, unique=True, nullable=True)
-    state_number = Column(String, unique=True, nullable=True)
+    vin = Column(String(255), unique=True, nullable=True)
+    state_number = Column(String(255), unique=True, nullable=True)
     price_range = Column(Integer, nullable=True) 
+    price_model_version = Column(String(255), nullable=True)   # версия модели, посчитавшей price_range
 
     
     seller = relationship("User", back_populates="cars")
@@ -99,9 +167,9 @@ class Photo(Base):
     __tablename__ = 'photos'
 
     photo_id = Column(Integer, primary_key=True, autoincrement=True)
-    body_type = Column(String, ForeignKey("body_type.body_type_name"))
-    car_id = Column(Integer, ForeignKey("cars.car_id"))
-    photo_url = Column(String, nullable=False)
+    body_type = Column(String(255), ForeignKey("body_type.body_type_name"))
+    car_id = Column(Integer, ForeignKey("cars.car_id"), index=True)
+    photo_url = Column(String(255), nullable=False)
 
     body_type_ref = relationship("BodyType", back_populates="photos")
     car_ref = relationship("Car", back_populates="photos")
@@ -109,31 +177,138 @@ class Photo(Base):
 
 class Favorite(Base):
     __tablename__ = 'favorites'
+    # (user_id, car_id) уникальна; индекс заодно обслуживает поиск по user_id
+    __table_args__ = (
+        Index('uq_favorites_user_car', 'user_id', 'car_id', unique=True),
+    )
     
     favorites_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.user_id"))
-    car_id = Column(Integer, ForeignKey("cars.car_id"))
+    car_id = Column(Integer, ForeignKey("cars.car_id"), index=True)
     
     user = relationship("User", back_populates="favorites")
     car_ref = relationship("Car", back_populates="favorites")
 
 
+class Recommendation(Base):
+    __tablename__ = 'recommendations'
+
+    # Готовые рекомендации из precompute_recommendations.py
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    car_ids = Column(Text, nullable=False)          # JSON-список car_id по убыванию сходства
+    generated_at = Column(TIMESTAMP, nullable=False)
+
+
+class ImportCheckpoint(Base):
+    __tablename__ = 'import_checkpoints'
+
+    # import_cars.py: сколько строк файла уже обработано; пишется
+    # в той же транзакции, что и пачка машин
+    source = Column(String(255), primary_key=True)
+    rows_done = Column(Integer, nullable=False)
+    updated_at = Column(TIMESTAMP, nullable=False)
+
+
+class FacetCount(Base):
+    __tablename__ = 'facet_counts'
+
+    # facets.py: число машин со значением value фасета facet; при
+    # filter_facet = '' — по всему каталогу, иначе среди машин с
+    # filter_facet = filter_value. Ключ начинается с фильтра: выборка
+    # фасетов под фильтр — один диапазон по первичному ключу
+    filter_facet = Column(String(32), primary_key=True)
+    filter_value = Column(String(255), primary_key=True)
+    facet = Column(String(32), primary_key=True)
+    value = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class MarketStat(Base):
+    __tablename__ = 'market_stats'
+
+    # market_stats.py: распределение цен по марке / модели / кузову;
+    # bodytype = '*' — все кузова модели, '' — значение не указано
+    brand = Column(String(255), primary_key=True)
+    model = Column(String(255), primary_key=True)
+    bodytype = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    price_min = Column(Float)
+    p10 = Column(Float)
+    p25 = Column(Float)
+    median = Column(Float)
+    p75 = Column(Float)
+    p90 = Column(Float)
+    price_max = Column(Float)
+    mean = Column(Float)
+    by_year = Column(Text)       # JSON {год выпуска: {count, median}}
+    by_mileage = Column(Text)    # JSON {начало корзины пробега: {count, median}}
+    changes = Column(Integer, nullable=False, default=0)   # изменения машин группы с последнего пересчёта
+    updated_at = Column(TIMESTAMP)
+
+
+class DerivedBuild(Base):
+    __tablename__ = 'derived_builds'
+
+    # facets.py, market_stats.py: производная таблица хотя бы раз посчитана
+    # по всей cars. До этого в ней только то, что дописали create_car и
+    # импорт, и нужен полный пересчёт — даже если она уже не пуста
+    name = Column(String(64), primary_key=True)
+    built_at = Column(TIMESTAMP, nullable=False)
+
+
+def is_built(conn, name: str) -> bool:
+    return conn.execute(
+        DerivedBuild.__table__.select().where(DerivedBuild.name == name)
+    ).first() is not None
+
+
+def mark_built(conn, name: str):
+    insert_ignore(conn, DerivedBuild.__table__, [{"name": name, "built_at": datetime.now()}])
+
+
+def insert_ignore(conn, table, rows: list):
+    # INSERT, пропускающий строки с уже существующим ключом
+    if not rows:
+        return
+    prefix = "OR IGNORE" if conn.dialect.name == "sqlite" else "IGNORE"
+    conn.execute(insert(table).prefix_with(prefix), rows)
+
+
+def ensure_schema(bind):
+    # create_all не трогает существующие таблицы: новые nullable-колонки
+    # дописываем через ALTER TABLE, недостающие индексы создаём отдельно
+    Base.metadata.create_all(bind)
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                col_type = column.type.compile(dialect=bind.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}')
+                print(f"Добавлена колонка {table.name}.{column.name}")
+
+    for table in Base.metadata.sorted_tables:
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind)
+                print(f"Создан индекс {index.name}")
+            except IntegrityError:
+                # в старой базе есть дубликаты — их убирает migrate.py
+                print(f"Индекс {index.name} не создан: есть дубликаты, запустите python migrate.py")
+
+
 if __name__ == "__main__":
-    Base.metadata.create_all(engine)
+    ensure_schema(engine)
     print("ORM модели успешно инициализированы и соответствуют базе данных.")
-    
 
-    # try:
-    #     count_cars = session.query(Car).count()
-    #     count_brands = session.query(Brand).count()
-    #     print(f"В базе найдено машин: {count_cars}")
-    #     print(f"В базе найдено брендов: {count_brands}")
-        
-    
-    #     first_car = session.query(Car).first()
-    #     if first_car:
-    #         print(f"Пример авто: {first_car.brand} {first_car.model}, Цена: {first_car.price}")
-    # except Exception as e:
-    #     print(f"Ошибка при чтении базы: {e}")
-    # finally:
-    session.close()
\ No newline at end of file
+    session = Session()
+    try:
+        print(f"В базе найдено машин: {session.query(Car).count()}")
+        print(f"В базе найдено брендов: {session.query(Brand).count()}")
+    finally:
+        session.close()
@@ -0,0 +1,124 @@
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, insert
+
+from models import Base, engine, Car, Favorite, Recommendation, Session as DBSession
+from car_recommendation import InventoryIndex
+
+# -----------------------------
+# Офлайн-расчёт рекомендаций для всех пользователей
+# -----------------------------
+# Запуск (например, из cron):
+#   python precompute_recommendations.py --top-n 100 --memory-mb 256
+#
+# Профили всех пользователей считаются одной матрицей
+# (пользователи × машины) @ (машины × признаки), затем скоринг идёт
+# блоками пользователей, чтобы матрица сходств занимала не больше
+# --memory-mb. Результат пишется в таблицу recommendations;
+# /api/cars/recommended отдаёт его, пока он свежий.
+
+
+def load_interactions(db, index):
+    # (user_id, строка индекса) для лайков и своих объявлений;
+    # повторы сохраняются, как и в онлайн-профиле
+    pairs = [(r.user_id, r.car_id) for r in db.query(Favorite.user_id, Favorite.car_id)]
+    pairs += [(r.seller_id, r.car_id) for r in db.query(Car.seller_id, Car.car_id).filter(Car.seller_id.isnot(None))]
+    return [(user_id, index.row_of[car_id]) for user_id, car_id in pairs if car_id in index.row_of]
+
+
+def inverse(values):
+    # 1/x с нулём для нулевых векторов
+    return np.divide(1.0, values, out=np.zeros_like(values), where=values > 0)
+
+
+def precompute(db, top_n: int = 100, memory_mb: int = 256, min_activity: int = 1):
+    started = time.perf_counter()
+    index = InventoryIndex()
+    index.build(db)
+    snap = index.snapshot()
+    n_cars = len(snap.car_ids)
+    if not n_cars:
+        return 0, 0.0
+
+    pairs = load_interactions(db, index)
+    if not pairs:
+        return 0, time.perf_counter() - started
+
+    user_ids, rows = np.array(pairs, dtype=np.int64).T
+    users, user_pos = np.unique(user_ids, return_inverse=True)
+    membership = sparse.csr_matrix(
+        (np.ones(len(rows)), (user_pos, rows)), shape=(len(users), n_cars)
+    )
+    counts = np.asarray(membership.sum(axis=1)).ravel()
+    active = np.flatnonzero(counts >= min_activity)
+
+    generated_at = datetime.now()
+    chunk = max(1, (memory_mb * 1024 * 1024) // (8 * n_cars))
+    k = min(top_n, n_cars)
+    written = 0
+
+    for start in range(0, len(active), chunk):
+        block = active[start:start + chunk]
+        member = membership[block]
+
+        # профили блока: среднее взвешенных векторов лайков и продаж
+        profiles = (member @ snap.matrix).toarray() / counts[block][:, None]
+        profile_norms = np.linalg.norm(profiles, axis=1)
+
+        # косинус: (машины × признаки) @ (признаки × пользователи)
+        scores = np.asarray(snap.matrix @ profiles.T).T
+        scores *= inverse(profile_norms)[:, None]
+        scores *= inverse(snap.norms)[None, :]
+
+        # свои и лайкнутые машины исключаем
+        member_coo = member.tocoo()
+        scores[member_coo.row, member_coo.col] = -np.inf
+
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        best = np.take_along_axis(best, np.argsort(-best_scores, axis=1, kind='stable'), axis=1)
+        best_scores = np.take_along_axis(scores, best, axis=1)
+
+        records = []
+        for i, pos in enumerate(block):
+            ranked = snap.car_ids[best[i][np.isfinite(best_scores[i])]]
+            records.append({
+                "user_id": int(users[pos]),
+                "car_ids": json.dumps([int(c) for c in ranked]),
+                "generated_at": generated_at,
+            })
+
+        block_users = [r["user_id"] for r in records]
+        db.execute(delete(Recommendation).where(Recommendation.user_id.in_(block_users)))
+        db.execute(insert(Recommendation), records)
+        db.commit()
+        written += len(records)
+
+    return written, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top-n', type=int, default=100)
+    parser.add_argument('--memory-mb', type=int, default=256)
+    parser.add_argument('--min-activity', type=int, default=1,
+                        help='минимум лайков + объявлений у пользователя')
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = DBSession()
+    try:
+        written, seconds = precompute(db, args.top_n, args.memory_mb, args.min_activity)
+    finally:
+        db.close()
+    rate = written / seconds if seconds else 0
+    print(f"✅ Рекомендации рассчитаны для {written} пользователей за {seconds:.1f} с ({rate:.0f} польз./с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import json
+import os
+from bisect import bisect_left
+
+import numpy as np
+
+# -----------------------------
+# Диапазоны цены как данные
+# -----------------------------
+# Границы лежат в price_bands.json (путь — PRICE_BANDS_PATH) вместе с
+# версией, так что сетку можно поменять без правки кода. Цена <= boundaries[i]
+# попадает в диапазон i, выше последней границы — в len(boundaries).
+#
+# band()  — одна цена, бинарный поиск по списку границ
+# bands() — массив / колонка DataFrame за один np.searchsorted
+
+BANDS_PATH = os.getenv("PRICE_BANDS_PATH", "price_bands.json")
+
+# Сетка по умолчанию — прежняя цепочка if: шаг 500 тыс. до 5 млн
+DEFAULT_BOUNDARIES = [500_000 * i for i in range(1, 11)]
+DEFAULT_VERSION = "default"
+
+
+class PriceBands:
+    def __init__(self, boundaries, version: str = DEFAULT_VERSION):
+        boundaries = [float(b) for b in boundaries]
+        if not boundaries:
+            raise ValueError("пустой список границ диапазонов цены")
+        if any(a >= b for a, b in zip(boundaries, boundaries[1:])):
+            raise ValueError("границы диапазонов цены должны строго возрастать")
+        self.version = version
+        self.boundaries = boundaries
+        self._array = np.asarray(boundaries)
+
+    @property
+    def count(self) -> int:
+        return len(self.boundaries) + 1
+
+    def band(self, price: float) -> int:
+        return bisect_left(self.boundaries, price)
+
+    def bands(self, prices, missing: int = -1) -> np.ndarray:
+        # prices — list / ndarray / pd.Series; NaN и None -> missing
+        values = np.asarray(prices, dtype=float)
+        result = np.searchsorted(self._array, values, side="left")
+        nan = np.isnan(values)
+        if nan.any():
+            result[nan] = missing
+        return result
+
+    def label(self, band: int) -> str:
+        # "до 500000", "500000–1000000", "от 5000000"
+        bounds = [f"{b:.0f}" for b in self.boundaries]
+        if band <= 0:
+            return f"до {bounds[0]}"
+        if band >= len(bounds):
+            return f"от {bounds[-1]}"
+        return f"{bounds[band - 1]}–{bounds[band]}"
+
+    def stats(self) -> dict:
+        return {"version": self.version, "boundaries": self.boundaries}
+
+
+def load_bands(path: str = BANDS_PATH) -> PriceBands:
+    if not os.path.exists(path):
+        return PriceBands(DEFAULT_BOUNDARIES)
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    return PriceBands(config["boundaries"], str(config.get("version", DEFAULT_VERSION)))
+
+
+try:
+    price_bands = load_bands()
+except Exception as e:
+    print(f"Ошибка загрузки диапазонов цены из {BANDS_PATH}: {e}")
+    price_bands = PriceBands(DEFAULT_BOUNDARIES)
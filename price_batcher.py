@@ -0,0 +1,132 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# -----------------------------
+# Микробатчинг предсказаний цены
+# -----------------------------
+# Параллельные create_car кладут словари машин в очередь и ждут Future.
+# Фоновый поток собирает пачку, пока не наберётся max_batch или не
+# пройдёт max_delay_ms с первой заявки, делает один вызов predict_batch
+# и раздаёт результаты — пары (price_range, версия модели) — ожидающим
+# запросам. Если задан lookup (кэш предсказаний), попадания
+# возвращаются сразу, не дожидаясь пачки. Если пачка не успела за
+# timeout секунд (медленная модель, забитая очередь), запрос считает
+# свою машину сам, прямым вызовом predict_batch.
+#
+# Настройки:
+#   PRICE_BATCH_SIZE      — размер пачки (1 — без батчинга)
+#   PRICE_BATCH_DELAY_MS  — сколько ждать добора пачки
+
+
+class PriceBatcher:
+    def __init__(self, predict_batch, max_batch: int = 32, max_delay_ms: float = 5, timeout: float = 10.0,
+                 lookup=None):
+        self.predict_batch = predict_batch
+        self.lookup = lookup
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # гистограмма заполнения пачек: верхняя граница корзины -> число пачек
+        self.buckets = [b for b in (1, 2, 4, 8, 16, 32, 64, 128, 256) if b < max_batch] + [max_batch]
+        self.fill_histogram = Counter()
+        self.counters = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch > 1
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="price-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, car: dict) -> Future:
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((car, future))
+        return future
+
+    def predict(self, car: dict) -> tuple:
+        # (price_range, версия модели) — элемент результата predict_batch
+        if self.lookup is not None:
+            cached = self.lookup(car)
+            if cached is not None:
+                self.counters["cache_hits"] += 1
+                return cached
+        if not self.enabled:
+            return self.predict_batch([car])[0]
+        future = self.submit(car)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Future не отменяем: поток пачки всё равно выставит результат
+            self.counters["timeouts"] += 1
+            return self.predict_batch([car])[0]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._record(len(batch))
+            cars = [car for car, _ in batch]
+            try:
+                results = self.predict_batch(cars)
+            except Exception as e:
+                print(f"Ошибка пакетного предсказания цены: {e}")
+                self.counters["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size: int):
+        self.counters["batches"] += 1
+        self.counters["predictions"] += size
+        self.counters["full_batches" if size >= self.max_batch else "timeout_flushes"] += 1
+        bucket = next(b for b in self.buckets if size <= b)
+        self.fill_histogram[bucket] += 1
+
+    def stats(self) -> dict:
+        batches = self.counters["batches"]
+        return {
+            "enabled": self.enabled,
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+            **self.counters,
+            "mean_fill": round(self.counters["predictions"] / batches, 2) if batches else None,
+            "queue_size": self._queue.qsize(),
+            # ключ — верхняя граница размера пачки
+            "fill_histogram": {f"<={b}": self.fill_histogram[b] for b in self.buckets},
+        }
+
+
+def make_batcher(predict_batch, lookup=None):
+    return PriceBatcher(
+        predict_batch,
+        lookup=lookup,
+        max_batch=int(os.getenv("PRICE_BATCH_SIZE", "32")),
+        max_delay_ms=float(os.getenv("PRICE_BATCH_DELAY_MS", "5")),
+    )
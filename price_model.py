@@ -45,21 +45,193 @@
 #         return "good"    # цена норм
 #     return "high"        # цена выше рынка
 
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
 import joblib
 import pandas as pd
 import numpy as np
 
-try:
-    model = joblib.load("catboost_mixed_features.pkl")
-except Exception as e:
-    print(f"Ошибка загрузки модели ML: {e}")
-    model = None
+from price_bands import price_bands
 
-def predict_price_range(car: dict) -> int:
-    if model is None:
-        return 0
+MODEL_PATH = os.getenv("PRICE_MODEL_PATH", "catboost_mixed_features.pkl")
+
+# Порядок признаков, если модель сама его не хранит
+FEATURE_ORDER = [
+    "bodyType", "brand", "color", "fuelType", "model_name",
+    "vehicleTransmission", "drivetrains", "wheel", "engineDisplacement",
+    "enginePower", "mileage", "productionDate", "owners", "car_age",
+]
+
+# Машина для прогрева свежезагруженной модели и замера задержки
+SAMPLE_CAR = {
+    "bodytype": "седан", "brand": "Toyota", "color": "белый", "fuel_type": "бензин",
+    "model": "Camry", "vehicle_transmission": "автоматическая", "drive_type": "передний",
+    "wheel": "Левый", "engine_displacement": 2.5, "engine_power": 181,
+    "mileage": 60000, "production_date": 2019, "owners": 1,
+}
+
+# -----------------------------
+# Реестр версий модели
+# -----------------------------
+# Модель загружается при первом предсказании или фоновым warm_up(),
+# а не при импорте. Дальше наблюдатель раз в PRICE_MODEL_WATCH_SECONDS
+# смотрит на mtime/размер файла; новая версия грузится и прогревается
+# в фоне, а текущая продолжает отвечать. Затем ссылка на ModelVersion
+# подменяется одним присваиванием: запрос, уже взявший старую версию,
+# доработает на ней. Версия — префикс sha256 файла, она пишется в
+# Car.price_model_version рядом с price_range.
+#
+# Новый файл лучше класть атомарно: записать рядом и сделать mv.
+
+ModelVersion = namedtuple("ModelVersion", "model version generation loaded_at load_seconds")
+
+def model_signature(path: str = None):
+    # mtime + размер: меняются при перезаписи файла модели
+    try:
+        st = os.stat(path or MODEL_PATH)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def file_version(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+class ModelRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self.current = ModelVersion(None, None, 0, None, None)
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._signature = None
+        self._stop = threading.Event()
+        self._watcher = None
+        self.counters = Counter()
+        self.last_error = None
+
+    def get(self) -> ModelVersion:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+        return self.current
+
+    def _load(self) -> bool:
+        # Вызывается под self._lock
+        signature = model_signature(self.path)
+        started = time.perf_counter()
+        try:
+            model = joblib.load(self.path)
+            version = file_version(self.path)
+        except Exception as e:
+            print(f"Ошибка загрузки модели ML: {e}")
+            self.counters["errors"] += 1
+            self.last_error = str(e)
+            # битый файл не перечитываем, пока он снова не изменится
+            self._signature = signature
+            return False
+        try:
+            # первый predict у CatBoost заметно медленнее — греем до подмены.
+            # Ошибка на SAMPLE_CAR — не повод отвергать загруженную модель:
+            # реальные машины она может предсказывать
+            predict_raw(model, [SAMPLE_CAR])
+        except Exception as e:
+            print(f"Предупреждение: прогрев модели ML {version} не удался: {e}")
+            self.counters["warm_up_errors"] += 1
+            self.last_error = f"warm-up {version}: {e}"
+
+        previous = self.current
+        if previous.model is not None and previous.version == version:
+            self._signature = signature
+            return False
+        self.current = ModelVersion(
+            model, version, previous.generation + 1, time.time(), round(time.perf_counter() - started, 3)
+        )
+        self._signature = signature
+        self.counters["loads"] += 1
+        if previous.model is not None:
+            print(f"Модель цены обновлена: {previous.version} -> {version}")
+        return True
+
+    def reload(self) -> bool:
+        # Загрузка новой версии; до подмены предсказания идут на старой
+        with self._lock:
+            self._loaded = True
+            return self._load()
+
+    def check(self) -> bool:
+        if model_signature(self.path) == self._signature:
+            return False
+        return self.reload()
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Ошибка наблюдателя модели ML: {e}")
+
+    def start_watcher(self, interval: float):
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="price-model-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        current = self.current
+        return {
+            "path": self.path,
+            "version": current.version,
+            "generation": current.generation,
+            "loaded_at": current.loaded_at,
+            "load_seconds": current.load_seconds,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+            **self.counters,
+            "last_error": self.last_error,
+        }
+
+registry = ModelRegistry(MODEL_PATH)
+
+def get_model():
+    return registry.get().model
+
+def warm_up(watch_seconds: float = None):
+    # Загрузка модели в фоне при старте API, затем наблюдение за файлом
+    if watch_seconds is None:
+        watch_seconds = float(os.getenv("PRICE_MODEL_WATCH_SECONDS", "10"))
+
+    def run():
+        registry.get()
+        registry.start_watcher(watch_seconds)
+
+    thread = threading.Thread(target=run, name="price-model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def __getattr__(name):
+    # price_model.model по-прежнему доступен, но грузится лениво
+    if name == "model":
+        return get_model()
+    raise AttributeError(name)
 
-    df = pd.DataFrame([{
+def car_features(car: dict) -> dict:
+    # Признаки модели из словаря машины (формат car_dict из create_car)
+    production_date = car["production_date"]
+    return {
         "bodyType": car["bodytype"],
         "brand": car["brand"],
         "color": car["color"],
@@ -71,34 +243,216 @@ def predict_price_range(car: dict) -> int:
         "engineDisplacement": car["engine_displacement"],
         "enginePower": car["engine_power"],
         "mileage": car["mileage"],
-        "productionDate": car["production_date"],
+        "productionDate": production_date,
         "owners": car["owners"],
-        "car_age": 2025 - car["production_date"]
-    }])
+        "car_age": 2025 - production_date if production_date is not None else None
+    }
 
-    pred = model.predict(df)
+def has_features(car: dict) -> bool:
+    # Все признаки модели заданы: CatBoost не принимает None в признаках,
+    # и одна неполная машина роняет предсказание всей пачки
+    return all(car.get(field) is not None for field in CACHE_FIELDS)
 
-    # ИСПРАВЛЕНИЕ:
-    # CatBoost может вернуть [[5]] или [5].
-    # .flatten() превращает это в [5], берем [0] -> получаем просто число 5
-    return int(pred.flatten()[0])
+def feature_rows(model, cars: list) -> list:
+    # Строки признаков в порядке модели — без pandas
+    names = list(getattr(model, "feature_names_", None) or FEATURE_ORDER)
+    rows = []
+    for car in cars:
+        features = car_features(car)
+        rows.append([features[name] for name in names])
+    return names, rows
+
+def predict_raw(model, cars: list):
+    if hasattr(model, "get_cat_feature_indices"):
+        # CatBoost: готовый Pool из списков, DataFrame не нужен
+        from catboost import Pool
+        names, rows = feature_rows(model, cars)
+        pool = Pool(rows, cat_features=model.get_cat_feature_indices(), feature_names=names)
+        return model.predict(pool)
+    # прочие модели ждут DataFrame с именами колонок
+    return model.predict(pd.DataFrame([car_features(car) for car in cars]))
+
+# -----------------------------
+# Кэш предсказаний
+# -----------------------------
+# Дилеры выкладывают пачки одинаковых машин, и каждая гоняла CatBoost
+# заново. Ключ кэша — нормализованный car_dict, пробег в ключе
+# округляется до корзины PRICE_CACHE_MILEAGE_BUCKET км. Модель всегда
+# считает по настоящим признакам машины; при попадании в кэш машина
+# получает значение, посчитанное для первой машины из той же корзины.
+# Кэш сбрасывается при смене версии модели.
+#
+# Настройки:
+#   PRICE_CACHE_SIZE            — число ключей в LRU (0 — без кэша)
+#   PRICE_CACHE_MILEAGE_BUCKET  — ширина корзины пробега, км
+
+CACHE_FIELDS = (
+    "bodytype", "brand", "color", "fuel_type", "model", "vehicle_transmission",
+    "drive_type", "wheel", "engine_displacement", "engine_power", "mileage",
+    "production_date", "owners",
+)
+MILEAGE_BUCKET = int(os.getenv("PRICE_CACHE_MILEAGE_BUCKET", "5000"))
+
+def normalize_car(car: dict) -> dict:
+    normalized = {}
+    for field in CACHE_FIELDS:
+        value = car.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        elif value is not None and field in ("engine_displacement", "engine_power"):
+            value = round(float(value), 2)
+        elif value is not None:
+            value = int(value)
+        normalized[field] = value
+    mileage = normalized["mileage"]
+    if mileage is not None and MILEAGE_BUCKET > 1:
+        normalized["mileage"] = mileage // MILEAGE_BUCKET * MILEAGE_BUCKET + MILEAGE_BUCKET // 2
+    return normalized
+
+def cache_key(normalized: dict) -> tuple:
+    return tuple(normalized[field] for field in CACHE_FIELDS)
+
+class PredictionCache:
+    # Записи относятся к одному поколению модели из registry: на более
+    # новом поколении кэш очищается, результаты старого не сохраняются
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.counters = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _sync(self, generation: int) -> bool:
+        if generation > self._generation:
+            if self._entries:
+                self.counters["invalidations"] += 1
+            self._entries.clear()
+            self._generation = generation
+        return generation == self._generation
+
+    def get(self, key, generation: int):
+        with self._lock:
+            value = self._entries.get(key) if self._sync(generation) else None
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def put(self, key, value, generation: int):
+        with self._lock:
+            if not self._sync(generation):
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "mileage_bucket": MILEAGE_BUCKET,
+            "generation": self._generation,
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+        }
+
+prediction_cache = PredictionCache(max_size=int(os.getenv("PRICE_CACHE_SIZE", "10000")))
+
+def cached_price_range(car: dict):
+    # Только поиск в кэше: (price_range, версия модели) или None
+    if not prediction_cache.enabled:
+        return None
+    current = registry.get()
+    value = prediction_cache.get(cache_key(normalize_car(car)), current.generation)
+    return None if value is None else (value, current.version)
+
+def predict_with_version(cars: list, lookup: bool = True) -> list:
+    # [(price_range, версия модели)] — один вызов model.predict на все
+    # машины; попадания в кэш и повторы внутри пачки в модель не идут.
+    # lookup=False — вызывающий уже проверил кэш (микробатчер)
+    current = registry.get()
+    if current.model is None:
+        return [(0, None)] * len(cars)
+    if not cars:
+        return []
+
+    if not prediction_cache.enabled:
+        return [(v, current.version) for v in predict_values(current.model, cars)]
+
+    keys = [cache_key(normalize_car(car)) for car in cars]
+    results = [None] * len(cars)
+    missing = {}
+    for i, key in enumerate(keys):
+        if key in missing:
+            continue
+        cached = prediction_cache.get(key, current.generation) if lookup else None
+        if cached is None:
+            missing[key] = i
+        else:
+            results[i] = cached
+
+    if missing:
+        values = predict_values(current.model, [cars[i] for i in missing.values()])
+        for key, value in zip(missing, values):
+            prediction_cache.put(key, value, current.generation)
+        computed = dict(zip(missing, values))
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = computed[key]
+    return [(v, current.version) for v in results]
+
+def predict_price_range_batch(cars: list, lookup: bool = True) -> list:
+    return [value for value, _ in predict_with_version(cars, lookup)]
+
+def predict_values(model, cars: list) -> list:
+    pred = predict_raw(model, cars)
+    # CatBoost может вернуть [[5], [3]] или [5, 3] — берём первый столбец
+    return [int(p) for p in np.asarray(pred).reshape(len(cars), -1)[:, 0]]
+
+def predict_price_range(car: dict) -> int:
+    return predict_price_range_batch([car])[0]
 
 def price_to_range(price: float) -> int:
-    if price <= 500_000: return 0
-    if price <= 1_000_000: return 1
-    if price <= 1_500_000: return 2
-    if price <= 2_000_000: return 3
-    if price <= 2_500_000: return 4
-    if price <= 3_000_000: return 5
-    if price <= 3_500_000: return 6
-    if price <= 4_000_000: return 7
-    if price <= 4_500_000: return 8
-    if price <= 5_000_000: return 9
-    return 10
+    # Границы диапазонов — price_bands.json (PRICE_BANDS_PATH)
+    return price_bands.band(price)
+
+def prices_to_ranges(prices) -> np.ndarray:
+    # Векторный вариант для массивов и колонок DataFrame
+    return price_bands.bands(prices)
 
 def get_price_badge(fact: int, ml: int) -> str:
     if ml > fact:
         return "low"     # цена ниже рынка (выгодная)
     if ml == fact:
         return "good"    # цена норм
-    return "high"        # цена выше рынка
\ No newline at end of file
+    return "high"        # цена выше рынка
+
+if __name__ == "__main__":
+    # Замер: загрузка модели и задержка предсказания одной машины
+    current = registry.get()
+    if current.model is not None:
+        print(f"модель {current.version}: загрузка и прогрев {current.load_seconds * 1000:.0f} мс")
+        model, car = current.model, SAMPLE_CAR
+        for label, call in (
+            ("DataFrame", lambda: model.predict(pd.DataFrame([car_features(car)]))),
+            ("fast path", lambda: predict_raw(model, [car])),
+        ):
+            call()
+            started = time.perf_counter()
+            for _ in range(200):
+                call()
+            print(f"{label}: {(time.perf_counter() - started) / 200 * 1000:.2f} мс на машину")
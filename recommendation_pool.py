@@ -0,0 +1,262 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+# -----------------------------
+# Скоринг рекомендаций в пуле процессов
+# -----------------------------
+# Векторная часть рекомендаций (профиль, сходство, top-k) держит GIL и
+# слот threadpool Starlette. В режиме пула она уходит в отдельные
+# процессы, а поток эндпоинта только ждёт результат.
+#
+# У каждого воркера своя копия InventoryIndex. Чтобы она не отставала
+# от основного процесса, с задачей передаётся хвост журнала дельт
+# inventory_index.changes; при разрыве журнала воркер перестраивает
+# индекс из БД.
+#
+# Настройки:
+#   RECOMMENDER_WORKERS      — число процессов (0 — считать в процессе API)
+#   RECOMMENDER_QUEUE_DEPTH  — максимум задач в пуле, сверх — cold start
+#   RECOMMENDER_TIMEOUT      — секунд ждать результат, затем cold start
+#
+# Процессы создаются и строят индекс при старте API (warm_up): запуск
+# spawn-воркера и импорт зависимостей дольше RECOMMENDER_TIMEOUT.
+
+# --- сторона воркера ---
+_worker_index = None
+_worker_seq = 0
+
+
+def _init_worker(main_seq: int = None):
+    global _worker_index, _worker_seq
+    from car_recommendation import inventory_index
+    _worker_index = inventory_index
+    if main_seq is None:
+        return
+    # индекс строится сразу, а не первой задачей; БД уже содержит все
+    # изменения до main_seq
+    from models import Session as DBSession
+    db = DBSession()
+    try:
+        _worker_index.build(db)
+        _worker_seq = main_seq
+    finally:
+        db.close()
+
+
+def ping_worker():
+    return {"pid": os.getpid(), "seq": _worker_seq}
+
+
+def _sync_worker_index(db, main_seq, changes):
+    global _worker_seq
+    from car_recommendation import load_car_rows
+
+    gap = changes and changes[0][0] > _worker_seq + 1
+    if _worker_index.built_at is None or gap or _worker_index.is_stale():
+        # БД уже содержит все изменения до main_seq
+        _worker_index.build(db)
+        _worker_seq = main_seq
+        return
+
+    for seq, op, car_id in changes:
+        if seq <= _worker_seq:
+            continue
+        if op == 'remove':
+            _worker_index.remove_car(car_id)
+        else:
+            rows = load_car_rows(db, [car_id])
+            if rows:
+                _worker_index.add_car(rows[0])
+        _worker_seq = seq
+    _worker_seq = max(_worker_seq, main_seq)
+    if _worker_index.is_stale():
+        # первые машины в индексе, построенном по пустой базе: без
+        # кодировщика нужен полный fit
+        _worker_index.build(db)
+
+
+def score_in_worker(profile_ids, exclude_ids, top_n, bodytype, main_seq, changes, submitted_at):
+    from models import Session as DBSession
+    from car_recommendation import rank_rows
+    from scipy import sparse
+
+    started_at = time.time()
+    db = DBSession()
+    try:
+        _sync_worker_index(db, main_seq, changes)
+        user_vectors = _worker_index.vectors_for(db, profile_ids)
+    finally:
+        db.close()
+
+    car_ids = []
+    if user_vectors:
+        profile = np.asarray(sparse.vstack(user_vectors).mean(axis=0)).ravel()
+        snap = _worker_index.snapshot(exclude_ids=exclude_ids)
+        if bodytype is not None:
+            snap = snap._replace(allowed=snap.allowed & (snap.features['bodyType'].to_numpy() == bodytype))
+        car_ids = [int(c) for c in snap.car_ids[rank_rows(snap, profile, top_n)]]
+
+    return {
+        "car_ids": car_ids,
+        "pid": os.getpid(),
+        "seq": _worker_seq,
+        "queue_wait": started_at - submitted_at,
+        "compute": time.time() - started_at,
+    }
+
+
+# --- сторона API ---
+class ScoringPool:
+    def __init__(self, index, workers: int = 0, queue_depth: int = None, timeout: float = 2.0, samples: int = 1000):
+        self.index = index
+        self.workers = workers
+        self.queue_depth = queue_depth or workers * 4
+        self.timeout = timeout
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(self.queue_depth, 1))
+        self._worker_seqs = {}
+        self.counters = Counter()
+        self.queue_wait = deque(maxlen=samples)
+        self.compute = deque(maxlen=samples)
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: форк процесса с потоками и блокировками API небезопасен
+                main_seq = self.index.change_seq
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(main_seq,),
+                )
+            return self._executor
+
+    def warm_up(self, timeout: float = 120.0):
+        # Поднимает все процессы пула и ждёт, пока они построят индекс.
+        # Задачи отправляются разом: spawn-пул запускает процесс на каждую
+        # задачу, пока число процессов меньше workers
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        executor = self._get_executor()
+        futures = [executor.submit(ping_worker) for _ in range(self.workers)]
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            if future.exception() is None:
+                result = future.result()
+                with self._lock:
+                    self._worker_seqs[result["pid"]] = result["seq"]
+            else:
+                print(f"Ошибка запуска пула рекомендаций: {future.exception()}")
+        if not_done:
+            print(f"Пул рекомендаций не поднялся за {timeout:.0f} с")
+        self.counters["warm_up_ms"] = round((time.perf_counter() - started) * 1000)
+
+    def _oldest_worker_seq(self) -> int:
+        with self._lock:
+            if len(self._worker_seqs) < self.workers:
+                return 0
+            return min(self._worker_seqs.values())
+
+    def _on_done(self, future):
+        self._slots.release()
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        with self._lock:
+            self._worker_seqs[result["pid"]] = result["seq"]
+        self.queue_wait.append(result["queue_wait"])
+        self.compute.append(result["compute"])
+
+    def score(self, profile_ids, exclude_ids, top_n: int, bodytype: str = None):
+        # Список car_id или None, если нужно отдать cold start
+        if not self._slots.acquire(blocking=False):
+            self.counters["rejected"] += 1
+            return None
+
+        main_seq, changes = self.index.changes_after(self._oldest_worker_seq())
+        try:
+            future = self._get_executor().submit(
+                score_in_worker, profile_ids, exclude_ids, top_n, bodytype,
+                main_seq, changes, time.time()
+            )
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._slots.release()
+            self._restart(e)
+            return None
+        future.add_done_callback(self._on_done)
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            # слот освободится, когда воркер всё-таки закончит
+            future.cancel()
+            self.counters["timeouts"] += 1
+            return None
+        except BrokenProcessPool as e:
+            self._restart(e)
+            return None
+        except Exception as e:
+            print(f"Ошибка скоринга рекомендаций в пуле: {e}")
+            self.counters["errors"] += 1
+            return None
+
+        self.counters["completed"] += 1
+        return result["car_ids"]
+
+    def _restart(self, error):
+        print(f"Пул рекомендаций упал, пересоздаём: {error}")
+        self.counters["errors"] += 1
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._worker_seqs = {}
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        def summary(samples):
+            values = np.array(samples)
+            if not len(values):
+                return None
+            return {
+                "count": len(values),
+                "mean_ms": round(values.mean() * 1000, 2),
+                "p50_ms": round(np.percentile(values, 50) * 1000, 2),
+                "p99_ms": round(np.percentile(values, 99) * 1000, 2),
+            }
+
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "timeout": self.timeout,
+            **self.counters,
+            "queue_wait": summary(list(self.queue_wait)),
+            "compute": summary(list(self.compute)),
+        }
+
+
+def make_pool(index):
+    workers = int(os.getenv("RECOMMENDER_WORKERS", "0"))
+    queue_depth = int(os.getenv("RECOMMENDER_QUEUE_DEPTH", "0")) or None
+    timeout = float(os.getenv("RECOMMENDER_TIMEOUT", "2.0"))
+    return ScoringPool(index, workers=workers, queue_depth=queue_depth, timeout=timeout)
@@ -0,0 +1,126 @@
+import threading
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from models import Brand, Model, BodyType, insert_ignore
+
+# -----------------------------
+# Кэш справочников: марки, модели, кузова
+# -----------------------------
+# Справочники маленькие и почти не меняются, поэтому держим их в памяти
+# процесса: прогрев при старте API, дополнение после успешного коммита.
+# create_car обращается к базе только за отсутствующими в кэше
+# значениями, и то одним INSERT IGNORE на таблицу в своей же транзакции.
+# Если строку уже добавил другой процесс (импорт), INSERT IGNORE её
+# просто пропустит — устаревший кэш безопасен.
+#
+# Основной путь — триггер BEFORE INSERT на cars (как триггеры cars_fts):
+# недостающие марка / модель / кузов вставляются самой базой в INSERT
+# машины, и create_car не делает за справочниками ни одного запроса.
+# Если триггер создать не удалось (в MariaDB нет права TRIGGER),
+# остаётся вставка через кэш; при триггере кэш не прогревается и
+# ensure() / remember() ничего не делают.
+
+TRIGGER_NAME = "cars_references_bi"
+
+
+def trigger_ddl(dialect: str) -> str:
+    if dialect == "sqlite":
+        return (
+            f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_NAME} BEFORE INSERT ON cars BEGIN "
+            "INSERT OR IGNORE INTO brands(brand_name) SELECT new.brand WHERE new.brand IS NOT NULL; "
+            "INSERT OR IGNORE INTO models(model_name, brand_name) SELECT new.model, new.brand "
+            "WHERE new.model IS NOT NULL; "
+            "INSERT OR IGNORE INTO body_type(body_type_name) SELECT new.bodytype WHERE new.bodytype IS NOT NULL; "
+            "END"
+        )
+    return (
+        f"CREATE TRIGGER {TRIGGER_NAME} BEFORE INSERT ON cars FOR EACH ROW BEGIN "
+        "IF new.brand IS NOT NULL THEN INSERT IGNORE INTO brands(brand_name) VALUES (new.brand); END IF; "
+        "IF new.model IS NOT NULL THEN "
+        "INSERT IGNORE INTO models(model_name, brand_name) VALUES (new.model, new.brand); END IF; "
+        "IF new.bodytype IS NOT NULL THEN "
+        "INSERT IGNORE INTO body_type(body_type_name) VALUES (new.bodytype); END IF; "
+        "END"
+    )
+
+
+def trigger_exists(conn) -> bool:
+    if conn.dialect.name == "sqlite":
+        return conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+        ), {"name": TRIGGER_NAME}).first() is not None
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.triggers WHERE trigger_schema = DATABASE() AND trigger_name = :name"
+    ), {"name": TRIGGER_NAME}).first() is not None
+
+
+def ensure_reference_trigger(bind) -> bool:
+    # True — справочники дополняет база, create_car их не трогает
+    try:
+        with bind.begin() as conn:
+            if not trigger_exists(conn):
+                conn.exec_driver_sql(trigger_ddl(conn.dialect.name))
+                print("Создан триггер справочников на cars")
+    except DBAPIError as e:
+        print(f"Триггер справочников не создан, справочники вставляет приложение: {e}")
+        return False
+    return True
+
+
+class ReferenceCache:
+    def __init__(self):
+        self.brands = set()
+        self.models = set()
+        self.body_types = set()
+        self.trigger = False      # справочники дополняет триггер на cars
+        self._lock = threading.Lock()
+
+    def warm(self, db: Session):
+        brands = set(db.execute(select(Brand.brand_name)).scalars())
+        models = set(db.execute(select(Model.model_name)).scalars())
+        body_types = set(db.execute(select(BodyType.body_type_name)).scalars())
+        with self._lock:
+            self.brands, self.models, self.body_types = brands, models, body_types
+
+    def missing(self, brand: str, model: str, bodytype: str) -> dict:
+        # Что нужно вставить: {таблица: строка}
+        rows = {}
+        if brand and brand not in self.brands:
+            rows[Brand.__table__] = {"brand_name": brand}
+        if model and model not in self.models:
+            rows[Model.__table__] = {"model_name": model, "brand_name": brand}
+        if bodytype and bodytype not in self.body_types:
+            rows[BodyType.__table__] = {"body_type_name": bodytype}
+        return rows
+
+    def ensure(self, db: Session, brand: str, model: str, bodytype: str) -> dict:
+        # Вставка недостающего в текущей транзакции, без коммита.
+        # Результат передаётся в remember() после успешного коммита
+        if self.trigger:
+            return {}
+        rows = self.missing(brand, model, bodytype)
+        for table, row in rows.items():
+            insert_ignore(db.connection(), table, [row])
+        return rows
+
+    def remember(self, rows: dict):
+        with self._lock:
+            for table, row in rows.items():
+                if table is Brand.__table__:
+                    self.brands.add(row["brand_name"])
+                elif table is Model.__table__:
+                    self.models.add(row["model_name"])
+                else:
+                    self.body_types.add(row["body_type_name"])
+
+    def stats(self) -> dict:
+        return {
+            "brands": len(self.brands), "models": len(self.models), "body_types": len(self.body_types),
+            "trigger": self.trigger,
+        }
+
+
+reference_cache = ReferenceCache()
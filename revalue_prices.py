@@ -0,0 +1,113 @@
+import argparse
+import time
+
+from sqlalchemy import select, update
+
+import price_model
+from models import Car, Session as DBSession, engine, ensure_schema
+
+# -----------------------------
+# Пересчёт price_range всех объявлений
+# -----------------------------
+# Запуск после переобучения модели:
+#   python revalue_prices.py --chunk-size 5000
+#
+# Объявления читаются пачками по car_id (keyset, без OFFSET),
+# предсказываются одним вызовом модели на пачку и записываются
+# bulk UPDATE по первичному ключу с коммитом на пачку.
+# price_range, как и в create_car, — разница между диапазоном от
+# модели и фактическим диапазоном цены; рядом пишется версия модели.
+
+FEATURE_COLUMNS = [
+    Car.car_id, Car.price, Car.bodytype, Car.brand, Car.color, Car.fuel_type,
+    Car.model, Car.vehicle_transmission, Car.drive_type, Car.wheel,
+    Car.engine_displacement, Car.engine_power, Car.mileage,
+    Car.production_date, Car.owners,
+]
+
+
+def row_to_car_dict(row) -> dict:
+    return {
+        "bodytype": row.bodytype,
+        "brand": row.brand,
+        "color": row.color,
+        "fuel_type": row.fuel_type,
+        "model": row.model,
+        "vehicle_transmission": row.vehicle_transmission,
+        "drive_type": row.drive_type,
+        "wheel": row.wheel,
+        "engine_displacement": float(row.engine_displacement) if row.engine_displacement is not None else None,
+        "engine_power": float(row.engine_power) if row.engine_power is not None else None,
+        "mileage": row.mileage,
+        "production_date": row.production_date,
+        "owners": row.owners,
+    }
+
+
+def iter_chunks(db, chunk_size: int):
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(*FEATURE_COLUMNS)
+            .where(Car.car_id > last_id, Car.price.isnot(None))
+            .order_by(Car.car_id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].car_id
+
+
+def revalue(db, chunk_size: int = 5000):
+    started = time.perf_counter()
+    total = 0
+    for rows in iter_chunks(db, chunk_size):
+        total += len(rows)
+        # объявления с пропусками в признаках модели не пересчитываются
+        cars = [(r, row_to_car_dict(r)) for r in rows]
+        cars = [(r, car) for r, car in cars if price_model.has_features(car)]
+        if not cars:
+            continue
+        rows = [r for r, _ in cars]
+        predicted = price_model.predict_with_version([car for _, car in cars])
+        actual = price_model.prices_to_ranges([float(r.price) for r in rows])
+        updates = [
+            {
+                "car_id": r.car_id,
+                "price_range": p - int(a),
+                "price_model_version": version,
+            }
+            for r, (p, version), a in zip(rows, predicted, actual)
+        ]
+        db.execute(update(Car), updates)
+        db.commit()
+
+        elapsed = time.perf_counter() - started
+        print(f"  {total} объявлений, {total / elapsed:.0f} строк/с")
+    return total, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    if price_model.get_model() is None:
+        print("Модель не загружена — пересчёт невозможен")
+        return
+    print(f"Версия модели: {price_model.registry.current.version}, "
+          f"диапазоны цены: {price_model.price_bands.version}")
+
+    ensure_schema(engine)
+    db = DBSession()
+    try:
+        total, seconds = revalue(db, args.chunk_size)
+    finally:
+        db.close()
+    rate = total / seconds if seconds else 0
+    print(f"✅ Пересчитано {total} объявлений за {seconds:.1f} с ({rate:.0f} строк/с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# -----------------------------
+# Форматирование машины для API
+# -----------------------------
+def format_car_dict(c, photos):
+    return {
+        "car_id": c.car_id,
+        "brand": c.brand,
+        "model": c.model,
+        "price": float(c.price or 0),
+        "mileage": c.mileage,
+        "year": c.production_date,
+        "production_date": c.production_date,
+        "engine_displacement": float(c.engine_displacement or 0),
+        "engine_power": float(c.engine_power or 0),
+        "fuel_type": c.fuel_type,
+        "vehicle_transmission": c.vehicle_transmission,
+        "bodytype": c.bodytype,
+        "body_type": c.bodytype, 
+        "color": c.color,
+        "drive_type": c.drive_type,
+        "wheel": c.wheel,
+        "owners": c.owners,
+        "vin": c.vin,
+        "state_number": c.state_number,
+        "description": c.description,
+        "price_range": c.price_range,
+        "photos": photos
+    }
@@ -0,0 +1,148 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, insert
+
+from models import make_engine, Base, User, Car, Favorite, Brand, Model, BodyType
+
+# -----------------------------
+# Синтетические данные для бенчмарков
+# -----------------------------
+# Запуск:
+#   python synthetic_data.py --db bench_data/cars.db --cars 100000 --users 1000 --likes 10
+#
+# Кардинальности близки к реальному каталогу; популярность значений
+# распределена по Zipf, как у марок и цветов на площадке.
+
+CARDINALITIES = {
+    'brand': 60,
+    'bodyType': 10,
+    'fuelType': 5,
+    'vehicleTransmission': 4,
+    'color': 16,
+    'wheel': 2,
+}
+MODELS_PER_BRAND = 12
+CHUNK = 50_000
+
+
+def zipf_choice(rng, values, size):
+    p = 1.0 / np.arange(1, len(values) + 1)
+    return rng.choice(values, size=size, p=p / p.sum())
+
+
+def synthetic_frame(n: int, seed: int = 0) -> pd.DataFrame:
+    # Признаки рекомендателя (car_recommendation.features_frame) без БД
+    from car_recommendation import categorical_features, numeric_features
+
+    rng = np.random.default_rng(seed)
+    data = {'car_id': np.arange(1, n + 1)}
+    for name in categorical_features:
+        data[name] = zipf_choice(rng, [f'{name}{i}' for i in range(CARDINALITIES[name])], n)
+    data['price_range'] = rng.integers(-5, 6, size=n)
+    data['enginePower'] = rng.normal(150, 50, size=n).clip(60, 600)
+    data['productionDate'] = rng.integers(1990, 2026, size=n)
+    return pd.DataFrame(data, columns=['car_id'] + categorical_features + numeric_features)
+
+
+def synthetic_cars(n: int, n_users: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frame = synthetic_frame(n, seed)
+    brand_idx = frame['brand'].str.slice(5).astype(int).to_numpy()
+    model_idx = rng.integers(0, MODELS_PER_BRAND, size=n)
+    production = frame['productionDate'].to_numpy()
+    mileage = ((2026 - production) * rng.normal(15_000, 5_000, size=n)).clip(0).astype(int)
+    price = (rng.lognormal(14.3, 0.6, size=n) * (1 + (production - 1990) / 36)).round(-3)
+
+    return pd.DataFrame({
+        'car_id': frame['car_id'],
+        'seller_id': rng.integers(1, n_users + 1, size=n),
+        'brand': frame['brand'],
+        'model': [f'brand{b}_model{m}' for b, m in zip(brand_idx, model_idx)],
+        'bodytype': frame['bodyType'],
+        'color': frame['color'],
+        'engine_displacement': rng.choice([1.4, 1.6, 2.0, 2.5, 3.0, 3.5], size=n),
+        'engine_power': frame['enginePower'].round(),
+        'fuel_type': frame['fuelType'],
+        'mileage': mileage,
+        'production_date': production,
+        'vehicle_transmission': frame['vehicleTransmission'],
+        'owners': rng.integers(1, 5, size=n),
+        'drive_type': zipf_choice(rng, ['front', 'rear', 'all'], n),
+        'wheel': frame['wheel'],
+        'price': price,
+        'price_range': frame['price_range'],
+        'vin': [f'SYN{i:014d}' for i in frame['car_id']],
+        'state_number': [f'S{i:09d}' for i in frame['car_id']],
+        'description': None,
+    })
+
+
+def insert_frame(conn, table, frame: pd.DataFrame):
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    for start in range(0, len(records), CHUNK):
+        conn.execute(insert(table), records[start:start + CHUNK])
+
+
+def generate(db_path: str, n_cars: int, n_users: int, seed: int = 0):
+    engine = make_engine(f'sqlite:///{db_path}')
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    cars = synthetic_cars(n_cars, n_users, seed)
+    users = pd.DataFrame({
+        'user_id': np.arange(1, n_users + 1),
+        'login': [f'user{i}' for i in range(1, n_users + 1)],
+        'password_hash': 'x',
+        'first_name': 'Bench',
+        'phone': [f'+7{i:010d}' for i in range(1, n_users + 1)],
+    })
+    models = cars[['model', 'brand']].drop_duplicates('model')
+
+    with engine.begin() as conn:
+        insert_frame(conn, User.__table__, users)
+        insert_frame(conn, Brand.__table__, pd.DataFrame({'brand_name': cars['brand'].unique()}))
+        insert_frame(conn, Model.__table__, models.rename(columns={'model': 'model_name', 'brand': 'brand_name'}))
+        insert_frame(conn, BodyType.__table__, pd.DataFrame({'body_type_name': cars['bodytype'].unique()}))
+        insert_frame(conn, Car.__table__, cars)
+    engine.dispose()
+
+
+def generate_favorites(db_path: str, n_cars: int, n_users: int, likes: int, seed: int = 1):
+    # Лайки пересоздаются отдельно, чтобы не генерировать инвентарь заново
+    rng = np.random.default_rng(seed)
+    engine = make_engine(f'sqlite:///{db_path}')
+    # у пользователя машина лайкнута не больше одного раза (uq_favorites_user_car)
+    likes = min(likes, n_cars)
+    favorites = pd.DataFrame({
+        'user_id': np.repeat(np.arange(1, n_users + 1), likes),
+        'car_id': np.concatenate([
+            rng.choice(n_cars, size=likes, replace=False) + 1 for _ in range(n_users)
+        ]) if likes else np.array([], dtype=np.int64),
+    })
+    with engine.begin() as conn:
+        conn.execute(delete(Favorite))
+        if likes:
+            insert_frame(conn, Favorite.__table__, favorites)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='bench_data/cars.db')
+    parser.add_argument('--cars', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--likes', type=int, default=10)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    generate(args.db, args.cars, args.users)
+    generate_favorites(args.db, args.cars, args.users, args.likes)
+    print(f"✅ {args.db}: {args.cars} машин, {args.users} пользователей, "
+          f"{args.likes} лайков на пользователя за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from itertools import count
+
+import pytest
+
+# -----------------------------
+# Окружение тестов
+# -----------------------------
+# База — временный файл SQLite; модель цены не грузится (price_range = 0),
+# фоновые потоки (наблюдение за моделью, рыночная статистика) выключены.
+# Переменные ставятся до импорта main / models: engine создаётся при импорте.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="sellcar_tests_")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TMP, 'cars.db')}"
+os.environ["PRICE_MODEL_PATH"] = os.path.join(TMP, "no_model.pkl")
+os.environ["PRICE_MODEL_WATCH_SECONDS"] = "0"
+os.environ["PRICE_BATCH_SIZE"] = "1"
+os.environ["MARKET_STATS_REFRESH_SECONDS"] = "0"
+os.environ["RECOMMENDER_WORKERS"] = "0"
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+import models
+
+_ids = count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def user(client):
+    # Новый пользователь; его токен ставится в куки клиента
+    n = next(_ids)
+    r = client.post("/api/register", json={
+        "login": f"user{n}", "password": "x", "first_name": "Test", "phone": f"+7900{n:07d}",
+    })
+    assert r.status_code == 200, r.text
+    token = r.json()["access_token"]
+    client.cookies.set("access_token", token)
+    return {"user_id": r.json()["user_id"], "token": token}
+
+
+def car_payload(**fields) -> dict:
+    n = next(_ids)
+    car = {
+        "brand": "Toyota", "model": "Camry", "production_date": 2015, "mileage": 80000,
+        "engine_displacement": 2.5, "price": 1_500_000, "description": "test car",
+        "bodytype": "sedan", "color": "white", "fuel_type": "petrol",
+        "vehicle_transmission": "automatic", "owners": 1, "drive_type": "fwd",
+        "wheel": "left", "engine_power": 181, "vin": f"VIN{n:014d}", "state_number": f"A{n:05d}AA",
+    }
+    car.update(fields)
+    return car
+
+
+@pytest.fixture
+def create_car(client):
+    def create(photos: int = 2, **fields) -> int:
+        r = client.post("/api/cars", json=car_payload(**fields))
+        assert r.status_code == 200, r.text
+        car_id = r.json()["car_id"]
+        if photos:
+            with models.engine.begin() as conn:
+                conn.execute(models.Photo.__table__.insert(), [
+                    {"car_id": car_id, "photo_url": f"/static/cars/{car_id}_{i}.jpg"} for i in range(photos)
+                ])
+        return car_id
+    return create
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def __len__(self):
+        return len(self.statements)
+
+    def matching(self, prefix: str) -> list:
+        return [s for s in self.statements if s.lstrip().upper().startswith(prefix)]
+
+
+@contextmanager
+def query_log(engine=None):
+    # SQL-запросы и коммиты, дошедшие до драйвера
+    engine = engine or models.engine
+    log = QueryLog()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        log.statements.append(statement)
+
+    def on_commit(conn):
+        log.commits += 1
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    event.listen(engine, "commit", on_commit)
+    try:
+        yield log
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+        event.remove(engine, "commit", on_commit)
+
+
+LEGACY_CARS = 5
+
+
+@pytest.fixture
+def legacy_db(monkeypatch):
+    # Отдельная база, где машины появились раньше facet_counts и
+    # market_stats: LEGACY_CARS машин Legacy L, производные таблицы пусты.
+    # import_cars.py пишет в неё
+    import import_cars
+
+    engine = models.make_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(dir=TMP), 'cars.db')}")
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(models.Car.__table__.insert(), [
+            {"brand": "Legacy", "model": "L", "bodytype": "sedan", "fuel_type": "petrol",
+             "price": 1_000_000 + i * 50_000, "production_date": 2015, "mileage": 60_000 + i * 1000}
+            for i in range(LEGACY_CARS)
+        ])
+    monkeypatch.setattr(import_cars, "engine", engine)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from ann_index import LSHIndex
+
+# -----------------------------
+# Кандидаты LSH
+# -----------------------------
+
+
+def brute_candidates(index: LSHIndex, matrix, vector) -> np.ndarray:
+    # строки, код которых хотя бы в одной таблице в пределах probes бит от запроса
+    codes, query = index._codes(matrix), index._codes(vector.reshape(1, -1))[0]
+    distance = np.vectorize(lambda x: bin(int(x)).count("1"))(codes ^ query)
+    return np.flatnonzero((distance <= index.probes).any(axis=1))
+
+
+@pytest.mark.parametrize("n_bits, probes", [(10, 0), (10, 1), (10, 2), (4, 1)])
+def test_candidates_match_hamming_radius(n_bits, probes):
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((3000, 16))
+    index = LSHIndex(n_tables=4, n_bits=n_bits, probes=probes).build(matrix[:2500])
+    index.add(2500, matrix[2500:])
+    for vector in rng.standard_normal((5, 16)):
+        assert np.array_equal(index.candidates(vector), brute_candidates(index, matrix, vector))
+
+
+def test_probes_beyond_code_length_are_rejected():
+    with pytest.raises(ValueError):
+        LSHIndex(n_bits=8, probes=9)
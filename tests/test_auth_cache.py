@@ -0,0 +1,75 @@
+import os
+import time
+from datetime import timedelta
+
+from auth import UserCache, UserSnapshot, create_access_token, user_cache
+from conftest import query_log
+
+# -----------------------------
+# Кэш токен -> пользователь
+# -----------------------------
+
+
+def me(client) -> dict:
+    r = client.get("/api/user")
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_cached_request_skips_database(client, user):
+    me(client)
+    with query_log() as log:
+        assert me(client)["user_id"] == user["user_id"]
+    assert len(log) == 0
+
+
+def test_profile_update_is_not_served_stale(client, user):
+    before = me(client)
+    r = client.put("/api/user/profile", json={"first_name": "Renamed", "last_name": "Later", "phone": before["phone"]})
+    assert r.status_code == 200, r.text
+    after = me(client)
+    assert (after["first_name"], after["last_name"]) == ("Renamed", "Later")
+
+
+def test_avatar_upload_is_not_served_stale(client, user):
+    assert me(client)["avatar_url"] is None
+    r = client.post("/api/user/avatar", files={"file": ("me.png", b"\x89PNG", "image/png")})
+    assert r.status_code == 200, r.text
+    try:
+        assert me(client)["avatar_url"] == r.json()["avatar_url"]
+    finally:
+        os.remove(r.json()["avatar_url"].lstrip("/"))
+
+
+def test_logout_drops_token(client, user):
+    me(client)
+    assert user_cache.get(user["token"]) is not None
+    assert client.post("/api/logout").status_code == 200
+    assert user_cache.get(user["token"]) is None
+
+
+def test_expired_token_is_rejected(client, user):
+    expired = create_access_token({"sub": me(client)["login"]}, timedelta(seconds=-1))
+    client.cookies.set("access_token", expired)
+    assert me(client) == {"authenticated": False}
+
+
+def test_entries_expire_by_ttl_and_token_exp():
+    snapshot = UserSnapshot(1, "u", "U", None, "+7", None)
+    cache = UserCache(ttl=60)
+    # истекает токен раньше TTL
+    cache.put("exp", snapshot, token_expires=time.time() + 0.05)
+    cache.put("long", snapshot, token_expires=time.time() + 60)
+    cache.ttl = 0.05
+    cache.put("ttl", snapshot)
+    assert cache.get("ttl") == cache.get("exp") == snapshot
+    time.sleep(0.1)
+    assert cache.get("ttl") is None and cache.get("exp") is None
+    assert cache.get("long") == snapshot
+
+
+def test_stats_endpoint(client, user):
+    me(client)
+    me(client)
+    stats = client.get("/api/auth/stats").json()["cache"]
+    assert stats["hits"] >= 1 and stats["size"] >= 1
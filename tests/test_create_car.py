@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import select
+
+import models
+from conftest import car_payload, query_log
+from reference_cache import TRIGGER_NAME, reference_cache
+
+# -----------------------------
+# POST /api/cars: одна транзакция, справочники без лишних запросов
+# -----------------------------
+# INSERT машины, счётчики фасетов и рыночной статистики, сброс готовых
+# рекомендаций, refresh после коммита
+
+MAX_STATEMENTS = 5
+REFERENCE_TABLES = ("brands", "models", "body_type")
+
+
+def reference_inserts(log) -> list:
+    return [s for s in log.matching("INSERT") if any(f" {t} " in s or f" {t}(" in s for t in REFERENCE_TABLES)]
+
+
+def references_exist(brand: str, model: str, bodytype: str) -> bool:
+    with models.engine.connect() as conn:
+        return all([
+            conn.execute(select(models.Brand).where(models.Brand.brand_name == brand)).first(),
+            conn.execute(select(models.Model).where(models.Model.model_name == model)).first(),
+            conn.execute(select(models.BodyType).where(models.BodyType.body_type_name == bodytype)).first(),
+        ])
+
+
+@pytest.fixture
+def warm_user(client, user):
+    # первый запрос по свежему токену читает пользователя — в кэш авторизации
+    post_car(client)
+    return user
+
+
+def post_car(client, **fields):
+    with query_log() as log:
+        r = client.post("/api/cars", json=car_payload(**fields))
+    assert r.status_code == 200, r.text
+    return log
+
+
+def test_known_references(client, warm_user):
+    log = post_car(client)
+    assert log.commits == 1
+    assert reference_inserts(log) == []
+    assert len(log) <= MAX_STATEMENTS
+
+
+def test_new_references_filled_by_trigger(client, warm_user):
+    assert reference_cache.trigger
+    log = post_car(client, brand="Zeekr", model="001", bodytype="shooting brake")
+    assert log.commits == 1
+    assert reference_inserts(log) == []
+    assert len(log) <= MAX_STATEMENTS
+    assert references_exist("Zeekr", "001", "shooting brake")
+    # при триггере кэш справочников не ведётся
+    assert "Zeekr" not in reference_cache.brands
+
+
+@pytest.fixture
+def without_trigger():
+    with models.engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TRIGGER {TRIGGER_NAME}")
+    reference_cache.trigger = False
+    yield
+    from reference_cache import ensure_reference_trigger
+    reference_cache.trigger = ensure_reference_trigger(models.engine)
+
+
+def test_new_references_without_trigger(client, warm_user, without_trigger):
+    log = post_car(client, brand="Haval", model="Jolion", bodytype="crossover")
+    assert log.commits == 1
+    # по одному INSERT IGNORE на отсутствующую в кэше таблицу
+    assert len(reference_inserts(log)) == 3
+    assert len(log) <= MAX_STATEMENTS + 3
+    assert references_exist("Haval", "Jolion", "crossover")
+
+    # теперь всё в кэше — справочники не трогаются
+    log = post_car(client, brand="Haval", model="Jolion", bodytype="crossover")
+    assert log.commits == 1
+    assert reference_inserts(log) == []
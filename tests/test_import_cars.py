@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import select
+
+import import_cars
+import price_model
+from models import Car, Session as DBSession
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "cars_missing_values.csv")
+CAT_FEATURES = ["bodyType", "brand", "color", "fuelType", "model_name", "vehicleTransmission", "drivetrains", "wheel"]
+
+
+@pytest.fixture
+def catboost_model():
+    # Маленькая настоящая модель CatBoost: как и боевая, падает на None
+    # в категориальных признаках
+    catboost = pytest.importorskip("catboost")
+    import pandas as pd
+
+    car = price_model.car_features(price_model.SAMPLE_CAR)
+    frame = pd.DataFrame([car] * 20)
+    frame["mileage"] = range(0, 200_000, 10_000)
+    model = catboost.CatBoostRegressor(iterations=5, verbose=False, allow_writing_files=False)
+    model.fit(frame[price_model.FEATURE_ORDER], [i % 5 for i in range(20)], cat_features=CAT_FEATURES)
+
+    registry = price_model.registry
+    previous, loaded = registry.current, registry._loaded
+    registry.current = price_model.ModelVersion(model, "test-model", previous.generation + 1, time.time(), 0.0)
+    registry._loaded = True
+    yield model
+    registry.current, registry._loaded = previous, loaded
+
+
+def imported_cars() -> dict:
+    db = DBSession()
+    try:
+        rows = db.execute(
+            select(Car.vin, Car.price_range, Car.price_model_version).where(Car.vin.like("CSVVIN%"))
+        ).all()
+        return {r.vin: r for r in rows}
+    finally:
+        db.close()
+
+
+def test_import_with_missing_values(client, catboost_model):
+    inserted, skipped, _ = import_cars.import_csv(FIXTURE, chunk_size=100, restart=True)
+    assert (inserted, skipped) == (10, 0)
+
+    cars = imported_cars()
+    assert len(cars) == 10
+    # пропуски в признаках модели: price_range из файла, без версии модели
+    assert (cars["CSVVIN0000000004"].price_range, cars["CSVVIN0000000004"].price_model_version) == (2, None)
+    assert (cars["CSVVIN0000000010"].price_range, cars["CSVVIN0000000010"].price_model_version) == (-1, None)
+    assert cars["CSVVIN0000000006"].price_model_version is None
+    # без цены: price_range из файла пуст
+    assert (cars["CSVVIN0000000008"].price_range, cars["CSVVIN0000000008"].price_model_version) == (None, None)
+    # полные строки посчитаны моделью
+    complete = ["CSVVIN0000000001", "CSVVIN0000000002", "CSVVIN0000000003", "CSVVIN0000000005",
+                "CSVVIN0000000007", "CSVVIN0000000009"]
+    assert all(cars[vin].price_model_version == "test-model" for vin in complete)
+
+    # checkpoint: повторный запуск файл не перечитывает
+    assert import_cars.import_csv(FIXTURE, chunk_size=100)[:2] == (0, 0)
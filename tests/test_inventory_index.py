@@ -0,0 +1,77 @@
+import threading
+import time
+
+import car_recommendation
+from car_recommendation import InventoryIndex, load_car_rows
+from models import Session as DBSession
+
+# -----------------------------
+# Перестройка индекса инвентаря
+# -----------------------------
+
+
+def wait_rebuilt(index: InventoryIndex, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while index.stats()["rebuilding"]:
+        assert time.monotonic() < deadline, "перестройка не закончилась"
+        time.sleep(0.01)
+
+
+def test_expired_index_rebuilds_in_background(client, user, create_car, monkeypatch):
+    create_car(photos=0, brand="Indexmark")
+    db = DBSession()
+    try:
+        index = InventoryIndex(max_age=60)
+        index.build(db)
+        generation = index.generation
+        index.built_at -= 120
+
+        # сборка нового индекса в фоне прочитала машины и ждёт, пока её
+        # не отпустят
+        release = threading.Event()
+        load = car_recommendation.load_car_rows
+
+        def slow_load(session, car_ids=None):
+            rows = load(session, car_ids)
+            if car_ids is None and threading.current_thread().name == "inventory-index-rebuild":
+                release.wait(10)
+            return rows
+
+        monkeypatch.setattr(car_recommendation, "load_car_rows", slow_load)
+
+        started = time.perf_counter()
+        index.ensure(db)
+        assert time.perf_counter() - started < 1
+        assert index.stats()["rebuilding"]
+
+        # запросы не ждут сборку: блокировка свободна, отвечает старый индекс
+        assert index._lock.acquire(timeout=1)
+        index._lock.release()
+        assert index.snapshot().matrix is not None
+        assert index.generation == generation
+
+        # машина, добавленная во время сборки, попадает в новый индекс
+        # из журнала дельт
+        car_id = create_car(photos=0, brand="Indexmark")
+        index.add_car(load_car_rows(db, [car_id])[0])
+
+        release.set()
+        wait_rebuilt(index)
+    finally:
+        db.close()
+
+    assert index.generation == generation + 1
+    assert not index.is_stale()
+    assert car_id in index.row_of
+    assert index.vector_of(car_id) is not None
+
+
+def test_first_build_is_synchronous(client, user, create_car):
+    create_car(photos=0)
+    index = InventoryIndex()
+    db = DBSession()
+    try:
+        index.ensure(db)
+    finally:
+        db.close()
+    assert index.built_at is not None and not index.stats()["rebuilding"]
@@ -0,0 +1,83 @@
+import os
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import import_cars
+import market_stats
+import models
+from conftest import LEGACY_CARS
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "cars_missing_values.csv")
+
+# -----------------------------
+# Пересекающиеся пересчёты market_stats
+# -----------------------------
+# Два пересчёта читают одни и те же changes и оба сохраняют результат:
+# вычитание не должно уводить changes в минус и терять новые отметки
+
+
+def changes(brand: str, model: str) -> dict:
+    with models.engine.connect() as conn:
+        return {
+            row.bodytype: row.changes for row in conn.execute(
+                select(models.MarketStat).where(models.MarketStat.brand == brand, models.MarketStat.model == model)
+            )
+        }
+
+
+def read(brand: str, model: str):
+    with models.engine.connect() as conn:
+        seen = {key: n for key, n in market_stats.pending(conn).items() if key[:2] == (brand, model)}
+        stats = market_stats.compute(market_stats.load_prices(conn, {(brand, model)}))
+    return seen, stats
+
+
+def save(seen: dict, stats: dict):
+    with models.engine.begin() as conn:
+        market_stats.save(conn, seen, stats)
+
+
+def test_overlapping_refreshes(client, user, create_car):
+    for _ in range(3):
+        create_car(photos=0, brand="Moskvich", model="3", bodytype="sedan", price=1_000_000)
+    assert changes("Moskvich", "3") == {"sedan": 3, "*": 3}
+
+    first, second = read("Moskvich", "3"), read("Moskvich", "3")
+    save(*first)
+    save(*second)
+    assert changes("Moskvich", "3") == {"sedan": 0, "*": 0}
+
+
+def test_mark_during_overlapping_refreshes(client, user, create_car):
+    for _ in range(2):
+        create_car(photos=0, brand="Moskvich", model="6", bodytype="sedan", price=700_000)
+
+    first, second = read("Moskvich", "6"), read("Moskvich", "6")
+    create_car(photos=0, brand="Moskvich", model="6", bodytype="sedan", price=750_000)
+    save(*first)
+    save(*second)
+    # отметка третьей машины дождётся следующего пересчёта
+    assert changes("Moskvich", "6") == {"sedan": 1, "*": 1}
+
+    market_stats.refresh(models.engine)
+    assert changes("Moskvich", "6") == {"sedan": 0, "*": 0}
+    with models.engine.connect() as conn:
+        count = conn.execute(select(models.MarketStat.count).where(
+            models.MarketStat.brand == "Moskvich", models.MarketStat.model == "6", models.MarketStat.bodytype == "*",
+        )).scalar()
+    assert count == 3
+
+
+def test_import_into_db_with_cars(legacy_db):
+    # импорт до первого старта API: группы старых машин тоже посчитаны
+    import_cars.import_csv(FIXTURE, chunk_size=4, restart=True)
+    market_stats.refresh(legacy_db)
+
+    with Session(legacy_db) as db:
+        stat = market_stats.lookup(db, "Legacy", "L", "sedan")
+    assert stat is not None
+    assert (stat["count"], stat["price_min"], stat["price_max"]) == (LEGACY_CARS, 1_000_000, 1_200_000)
+
+    # уже посчитано: следующий старт полный пересчёт не повторяет
+    assert market_stats.ensure_market_stats(legacy_db) is False
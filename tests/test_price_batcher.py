@@ -0,0 +1,35 @@
+import threading
+
+from price_batcher import PriceBatcher
+
+# -----------------------------
+# Микробатчер предсказаний цены
+# -----------------------------
+
+
+def test_slow_batch_falls_back_to_direct_call():
+    release = threading.Event()
+
+    def predict_batch(cars):
+        if threading.current_thread().name == "price-batcher":
+            # пачка зависла в модели
+            release.wait(5)
+            return [(1, "batch")] * len(cars)
+        return [(2, "direct")] * len(cars)
+
+    batcher = PriceBatcher(predict_batch, max_batch=4, max_delay_ms=1, timeout=0.05)
+    try:
+        assert batcher.predict({"brand": "Lada"}) == (2, "direct")
+        assert batcher.stats()["timeouts"] == 1
+    finally:
+        release.set()
+
+    # поток пачки пережил брошенную заявку и обслуживает следующие
+    batcher.timeout = 5
+    assert batcher.predict({"brand": "Lada"}) == (1, "batch")
+
+
+def test_batch_within_timeout():
+    batcher = PriceBatcher(lambda cars: [(len(cars), "batch")] * len(cars), max_batch=4, max_delay_ms=1)
+    assert batcher.predict({"brand": "Lada"}) == (1, "batch")
+    assert batcher.stats().get("timeouts", 0) == 0
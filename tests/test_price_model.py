@@ -0,0 +1,37 @@
+import joblib
+
+import price_model
+
+# -----------------------------
+# Загрузка модели цены
+# -----------------------------
+
+
+class SampleFailingModel:
+    # падает на прогревочной SAMPLE_CAR, остальные машины предсказывает
+    def predict(self, frame):
+        if (frame["brand"] == price_model.SAMPLE_CAR["brand"]).any():
+            raise ValueError("unexpected sample value")
+        return [3] * len(frame)
+
+
+def test_warm_up_failure_keeps_model(tmp_path):
+    path = tmp_path / "model.pkl"
+    joblib.dump(SampleFailingModel(), path)
+    registry = price_model.ModelRegistry(str(path))
+
+    current = registry.get()
+    assert isinstance(current.model, SampleFailingModel)
+    stats = registry.stats()
+    assert stats["loads"] == 1 and stats["warm_up_errors"] == 1
+    assert stats["last_error"].startswith(f"warm-up {current.version}")
+    car = {**price_model.SAMPLE_CAR, "brand": "Lada"}
+    assert list(price_model.predict_raw(current.model, [car])) == [3]
+
+
+def test_unreadable_file_is_rejected(tmp_path):
+    path = tmp_path / "model.pkl"
+    path.write_bytes(b"not a pickle")
+    registry = price_model.ModelRegistry(str(path))
+    assert registry.get().model is None
+    assert registry.stats()["errors"] == 1
@@ -0,0 +1,52 @@
+import pytest
+
+from conftest import query_log
+
+# -----------------------------
+# Число SQL-запросов на запрос к API не зависит от размера выдачи
+# -----------------------------
+# Фото грузятся одним selectin-запросом, продавец — JOIN, sales_count —
+# подзапрос. Пользователь по токену берётся из auth.user_cache, поэтому
+# перед замером эндпоинт вызывается один раз.
+
+MAX_LIST_STATEMENTS = 2      # машины + фото
+MAX_DETAIL_STATEMENTS = 2    # машина с продавцом и sales_count + фото
+
+
+def measure(client, url: str) -> int:
+    assert client.get(url).status_code == 200
+    with query_log() as log:
+        r = client.get(url)
+    assert r.status_code == 200, r.text
+    return len(log), r.json()
+
+
+@pytest.mark.parametrize("n_cars", [1, 15])
+def test_user_cars_statements(client, user, create_car, n_cars):
+    for _ in range(n_cars):
+        create_car(photos=3)
+    statements, cars = measure(client, "/api/user/cars")
+    assert len(cars) == n_cars
+    assert all(len(c["photos"]) == 3 for c in cars)
+    assert statements <= MAX_LIST_STATEMENTS
+
+
+@pytest.mark.parametrize("n_cars", [1, 15])
+def test_favorites_statements(client, user, create_car, n_cars):
+    car_ids = [create_car(photos=2) for _ in range(n_cars)]
+    for car_id in car_ids:
+        assert client.post(f"/api/favorites/{car_id}").json()["status"] == "added"
+    statements, cars = measure(client, "/api/user/favorites")
+    assert [c["car_id"] for c in cars] == car_ids
+    assert all(len(c["photos"]) == 2 for c in cars)
+    assert statements <= MAX_LIST_STATEMENTS
+
+
+@pytest.mark.parametrize("n_cars, n_photos", [(1, 1), (15, 10)])
+def test_car_details_statements(client, user, create_car, n_cars, n_photos):
+    car_ids = [create_car(photos=n_photos) for _ in range(n_cars)]
+    statements, car = measure(client, f"/api/cars/{car_ids[0]}")
+    assert len(car["photos"]) == n_photos
+    assert car["seller"]["sales_count"] == n_cars
+    # + одна строка market_stats
+    assert statements <= MAX_DETAIL_STATEMENTS + 1
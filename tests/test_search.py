@@ -0,0 +1,59 @@
+import base64
+import json
+
+import pytest
+
+from car_search import encode_cursor
+
+# -----------------------------
+# Keyset-пагинация /api/cars/search
+# -----------------------------
+
+
+def raw_cursor(data) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def search(client, **params):
+    return client.get("/api/cars/search", params=params)
+
+
+def test_pages_follow_cursor(client, user, create_car):
+    ids = {create_car(photos=0, brand="Cursormark", price=1_000_000 + i * 1000) for i in range(5)}
+    seen, cursor = [], None
+    while True:
+        params = {"brand": "Cursormark", "sort": "price_asc", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = search(client, **params)
+        assert r.status_code == 200, r.text
+        seen += [item["car_id"] for item in r.json()["items"]]
+        cursor = r.json()["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(ids)
+
+
+@pytest.mark.parametrize("sort, values", [
+    ("price_asc", [{"a": 1}, 2]),
+    ("price_asc", ["1000", 2]),
+    ("price_asc", [1000, 2.5]),
+    ("price_asc", [None, 2]),
+    ("price_asc", [True, 2]),
+    ("price_asc", [float("inf"), 2]),
+    ("year_desc", [2015.5, 2]),
+    ("newest", [[1]]),
+])
+def test_tampered_cursor_is_rejected(client, sort, values):
+    r = search(client, sort=sort, cursor=raw_cursor({"s": sort, "v": values}))
+    assert r.status_code == 400, r.text
+
+
+def test_tampered_relevance_cursor_is_rejected(client):
+    r = search(client, q="test", cursor=raw_cursor({"s": "relevance", "v": ["x", 1]}))
+    assert r.status_code == 400, r.text
+
+
+def test_cursor_from_other_sort_is_rejected(client):
+    r = search(client, sort="year_desc", cursor=encode_cursor("price_asc", [1000, 1]))
+    assert r.status_code == 400, r.text